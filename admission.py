@@ -0,0 +1,128 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Commands that start new work on the server. These are the ones shed under load; replies to
+# work already in progress (OFFER, ACCEPT, REFUSE, CANCEL) are always let through.
+SHEDDABLE_COMMANDS = {"REGISTER", "LOOKING_FOR", "BUY", "PEER_SEARCH"}
+
+
+def parse_rate_limits(spec):
+    """Parse "COMMAND=rate:burst,..." (rate in requests per second) into {command: (rate, burst)}."""
+    limits = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        command, _, values = entry.partition("=")
+        rate, _, burst = values.partition(":")
+        limits[command.strip().upper()] = (float(rate), float(burst or 1))
+    return limits
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.last = clock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def take(self):
+        """Take one token. Returns 0 if allowed, otherwise the seconds until a token is available."""
+        self.refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+
+class AdmissionController:
+    """Decide whether an incoming command is admitted, and count what was throttled.
+
+    Three checks are applied, cheapest first:
+    - load shedding: new work is refused while the dispatch backlog is above the watermark
+    - a global cap on searches that are still waiting for offers
+    - a per-client token bucket for each rate limited command
+
+    Clients are identified by whatever key the caller passes. The server uses the client name only when the
+    message comes from that client's registered address, and the source IP otherwise, so a sender can't get a
+    fresh bucket by changing the name in its messages or its source port. A search slot is taken by `search_started`
+    once a search really waits for offers, not on admission, so a message that fails later never holds one.
+    """
+
+    max_buckets = 10000  # The least recently used buckets are dropped once there are more than this
+
+    def __init__(self, rate_limits, max_searches=0, backlog_watermark=0, search_retry_after=5.0,
+                 clock=time.monotonic):
+        self.rate_limits = rate_limits
+        self.max_searches = max_searches
+        self.backlog_watermark = backlog_watermark
+        self.search_retry_after = search_retry_after
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+        self.backlog = 0
+        self.open_searches = 0
+        self.admitted = {}
+        self.throttled = {}
+
+    def admit(self, command, client_key):
+        """Returns (admitted, retry_after)."""
+        with self.lock:
+            retry_after = 0
+            reason = None
+            if self.backlog_watermark and self.backlog >= self.backlog_watermark and command in SHEDDABLE_COMMANDS:
+                reason, retry_after = "shed", 1.0
+            elif command == "LOOKING_FOR" and self.max_searches and self.open_searches >= self.max_searches:
+                reason, retry_after = "search_cap", self.search_retry_after
+            elif command in self.rate_limits:
+                retry_after = self.bucket(command, client_key).take()
+                if retry_after:
+                    reason = "rate_limit"
+
+            if reason:
+                self.throttled[(reason, command)] = self.throttled.get((reason, command), 0) + 1
+                return False, retry_after
+
+            self.admitted[command] = self.admitted.get(command, 0) + 1
+            return True, 0
+
+    def bucket(self, command, client_key):
+        """Token bucket of a client for a command. Must be called with the lock held."""
+        key = (command, client_key)
+        if key in self.buckets:
+            self.buckets.move_to_end(key)
+        else:
+            if len(self.buckets) >= self.max_buckets:
+                self.buckets.popitem(last=False)
+            rate, burst = self.rate_limits[command]
+            self.buckets[key] = TokenBucket(rate, burst, self.clock)
+        return self.buckets[key]
+
+    def dispatch_started(self):
+        with self.lock:
+            self.backlog += 1
+
+    def dispatch_finished(self):
+        with self.lock:
+            self.backlog -= 1
+
+    def search_started(self):
+        with self.lock:
+            self.open_searches += 1
+
+    def search_finished(self):
+        with self.lock:
+            self.open_searches = max(0, self.open_searches - 1)
+
+    def summary(self):
+        """One line describing current load and throttling counters."""
+        with self.lock:
+            throttled = ", ".join(f"{command}/{reason}={count}"
+                                  for (reason, command), count in sorted(self.throttled.items()))
+            admitted = ", ".join(f"{command}={count}" for command, count in sorted(self.admitted.items()))
+            return (f"backlog={self.backlog} open_searches={self.open_searches} "
+                    f"admitted: {admitted or 'none'} throttled: {throttled or 'none'}")
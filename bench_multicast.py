@@ -0,0 +1,134 @@
+import socket
+import threading
+import time
+import argparse
+import selectors
+
+from multicast import join_group, configure_sender
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Compare unicast and multicast SEARCH fan-out on loopback")
+    parser.add_argument("--receivers", type=int, default=200, help="Number of simulated peers")
+    parser.add_argument("--rounds", type=int, default=50, help="Number of SEARCH messages to send")
+    parser.add_argument("--multicast_group", type=str, default="239.255.36.6", help="Multicast group to test")
+    parser.add_argument("--multicast_port", type=int, default=5199, help="UDP port of the multicast group")
+    parser.add_argument("--timeout", type=float, default=2.0, help="Seconds to wait for every peer to receive")
+    return parser.parse_args()
+
+
+class Receivers:
+    """Receive on many sockets from one thread and note when the last one got the current message."""
+
+    def __init__(self, sockets):
+        self.sockets = sockets
+        self.selector = selectors.DefaultSelector()
+        for sock in sockets:
+            sock.setblocking(False)
+            self.selector.register(sock, selectors.EVENT_READ)
+        self.lock = threading.Lock()
+        self.expected = None
+        self.received = 0
+        self.last_delivery = None
+        self.done = threading.Event()
+        self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def expect(self, message):
+        with self.lock:
+            self.expected = message
+            self.received = 0
+            self.done.clear()
+
+    def run(self):
+        while self.running:
+            for key, events in self.selector.select(timeout=0.1):
+                try:
+                    message = key.fileobj.recv(1024)
+                except BlockingIOError:
+                    continue
+                now = time.perf_counter()
+                with self.lock:
+                    if message == self.expected:
+                        self.received += 1
+                        if self.received == len(self.sockets):
+                            self.last_delivery = now
+                            self.done.set()
+
+    def close(self):
+        self.running = False
+        for sock in self.sockets:
+            sock.close()
+
+
+def run_rounds(name, receivers, send, rounds, timeout):
+    """Send `rounds` messages and collect sender CPU time and time-to-last-delivery for each."""
+    cpu_times = []
+    delivery_times = []
+    lost = 0
+    for i in range(rounds):
+        message = f"SEARCH RQ{i} lamp red bench".encode()
+        receivers.expect(message)
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        send(message)
+        cpu_times.append(time.thread_time() - cpu_start)
+        if receivers.done.wait(timeout):
+            delivery_times.append(receivers.last_delivery - start)
+        else:
+            lost += 1
+    report(name, cpu_times, delivery_times, lost)
+
+
+def report(name, cpu_times, delivery_times, lost):
+    def stats(values):
+        if not values:
+            return "-"
+        values = sorted(values)
+        mean = sum(values) / len(values)
+        return f"mean {mean * 1e6:9.1f}us  p50 {values[len(values) // 2] * 1e6:9.1f}us  max {values[-1] * 1e6:9.1f}us"
+
+    print(f"{name}:")
+    print(f"  send CPU:              {stats(cpu_times)}")
+    print(f"  time to last delivery: {stats(delivery_times)}")
+    if lost:
+        print(f"  rounds not delivered to every peer: {lost}")
+
+
+def main():
+    args = parse_arguments()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.bind(("127.0.0.1", 0))
+    print(f"{args.receivers} peers, {args.rounds} rounds\n")
+
+    # Unicast: one sendto per peer, like the default broadcast_search loop
+    sockets = []
+    for i in range(args.receivers):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        sockets.append(sock)
+    addresses = [sock.getsockname() for sock in sockets]
+    receivers = Receivers(sockets)
+
+    def send_unicast(message):
+        for address in addresses:
+            sender.sendto(message, address)
+
+    run_rounds("Unicast", receivers, send_unicast, args.rounds, args.timeout)
+    receivers.close()
+
+    # Multicast: one sendto reaches every peer that joined the group
+    try:
+        sockets = [join_group(args.multicast_group, args.multicast_port, "127.0.0.1") for i in range(args.receivers)]
+    except OSError as e:
+        print(f"\nMulticast unavailable on this host: {e}")
+        return
+    configure_sender(sender, "127.0.0.1")
+    receivers = Receivers(sockets)
+    group = (args.multicast_group, args.multicast_port)
+    run_rounds("Multicast", receivers, lambda message: sender.sendto(message, group), args.rounds, args.timeout)
+    receivers.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+import argparse
+import contextlib
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from server import Client, create_server, parse_arguments as parse_server_arguments
+from simulator import VirtualClock
+
+BENCHMARKS = ["broadcast_search", "process_offers", "save_data", "load_data", "handle_message"]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the P2P Shopping server's hot paths in-process")
+    parser.add_argument("--sizes", type=str, default="10,100,1000,10000,100000,1000000",
+                        help="Comma-separated problem sizes to run every benchmark at")
+    parser.add_argument("--benchmarks", type=str, default=",".join(BENCHMARKS),
+                        help=f"Comma-separated benchmarks to run ({', '.join(BENCHMARKS)})")
+    parser.add_argument("--min_time", type=float, default=0.2,
+                        help="Minimum seconds to repeat each measurement for (at least one run is always made)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Timing rounds per measurement, the fastest round is kept to reduce noise")
+    parser.add_argument("--baseline", type=str, default="bench_baseline.json", help="Baseline file to compare against")
+    parser.add_argument("--save_baseline", action="store_true", help="Write this run's results to the baseline file")
+    parser.add_argument("--margin", type=float, default=0.25,
+                        help="Allowed regression against the baseline (0.25 = 25%% slower or larger)")
+    parser.add_argument("--output", type=str, default=None, help="Also write this run's results to a JSON file")
+    return parser.parse_args()
+
+
+class NullTransport:
+    """Transport that drops everything, so only the server's own work is measured."""
+
+    def send_udp(self, message, address):
+        pass
+
+    def request_tcp(self, address, message, timeout):
+        return ""
+
+    def send_tcp(self, address, message, timeout):
+        pass
+
+
+def new_server(data_file="", clock=None):
+    args = parse_server_arguments(["--data_file", data_file, "--log_file", "", "--rate_limits", ""])
+    return create_server(args, NullTransport(), clock or VirtualClock())
+
+
+def add_clients(server, count):
+    for i in range(count):
+        name = f"peer{i}"
+        server.all_clients[name] = Client(name, f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}", "6000", "6001")
+
+
+def search_entry(requester_name, offers):
+    return {"requester_name": requester_name, "item_name": "lamp", "max_price": 100, "offers": offers,
+            "expected_offers": len(offers) + 1, "pending_nodes": 0}
+
+
+# Each setup function builds the state for one size and returns (operation to measure, reset). `reset` runs after
+# every operation, outside the timed region, and undoes what the operation added so each run sees the same state.
+
+def setup_broadcast_search(size):
+    """One LOOKING_FOR fanned out to `size` registered clients."""
+    clock = VirtualClock()
+    server = new_server(clock=clock)
+    add_clients(server, size)
+
+    def reset():
+        del server.active_searches["RQ1"]
+        del server.offer_windows["RQ1"]
+        clock.timers.clear()
+        server.admission.search_finished()
+
+    return lambda: server.broadcast_search("RQ1", "peer0", "lamp", "red", "100"), reset
+
+
+def setup_process_offers(size):
+    """Picking the best of `size` offers for one search."""
+    server = new_server()
+    add_clients(server, min(size, 1000))
+    offers = [(f"peer{i % 1000}", "lamp", 50 + i % 97) for i in range(size)]
+    server.active_searches["RQ1"] = search_entry("peer0", offers)
+    # The reservation and search status it writes are the same on every run
+    return lambda: server.process_offers("RQ1"), None
+
+
+def populate_state(server, size):
+    """`size` registered clients with one open search and one reservation per ten of them."""
+    add_clients(server, size)
+    for i in range(max(1, size // 10)):
+        server.active_searches[f"RQ{i}"] = search_entry(f"peer{i}", [(f"peer{i + 1}", "lamp", 60)])
+        server.reservations[f"RQ{i}"] = {"seller_name": f"peer{i + 1}", "item_name": "lamp", "price": 60}
+
+
+def setup_save_data(size, data_file):
+    """Writing the state of `size` registered clients to the data file."""
+    server = new_server(data_file)
+    populate_state(server, size)
+    return server.save_data, None
+
+
+def setup_load_data(size, data_file):
+    """Reading the state of `size` registered clients back from the data file."""
+    setup_save_data(size, data_file)[0]()
+    server = new_server(data_file)
+    return server.load_data, None
+
+
+def setup_handle_message(size):
+    """Parsing and dispatching an OFFER for one of `size` open searches."""
+    server = new_server()
+    add_clients(server, min(size, 1000))
+    for i in range(size):
+        server.active_searches[f"RQ{i}"] = search_entry("peer0", [])
+    address = ("10.0.0.1", 6000)
+    messages = [(f"RQ{i}", f"OFFER RQ{i} peer{i % 1000} lamp 60") for i in range(0, size, max(1, size // 1000))]
+    state = {"next": 0}
+
+    def handle_offer():
+        server.handle_message(messages[state["next"] % len(messages)][1], address, "UDP")
+
+    def reset():
+        server.active_searches[messages[state["next"] % len(messages)][0]]["offers"].pop()
+        state["next"] += 1
+
+    return handle_offer, reset
+
+
+def measure(operation, reset, min_time, repeat, allocation_runs=10):
+    """Measure the allocations of `allocation_runs` runs of `operation` on the fresh state, then time `repeat`
+    rounds of repeated runs and keep the fastest. Only `operation` is timed, `reset` runs after each one."""
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    for _ in range(allocation_runs):
+        operation()
+        if reset:
+            reset()
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        runs = 0
+        elapsed = 0
+        while elapsed < min_time:
+            start = time.perf_counter()
+            operation()
+            elapsed += time.perf_counter() - start
+            runs += 1
+            if reset:
+                reset()
+        if best is None or elapsed / runs < best[1] / best[0]:
+            best = (runs, elapsed)
+    runs, elapsed = best
+    return {
+        "runs": runs,
+        "ops_per_sec": runs / elapsed,
+        "sec_per_op": elapsed / runs,
+        "peak_bytes": peak - before,
+        "retained_bytes_per_op": (after - before) / allocation_runs,
+    }
+
+
+def run_benchmark(name, size, min_time, repeat, data_file):
+    setup = globals()[f"setup_{name}"]
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        operation, reset = setup(size, data_file) if name in ("save_data", "load_data") else setup(size)
+        # Fewer traced runs at large sizes, where tracemalloc makes a run take many seconds
+        result = measure(operation, reset, min_time, repeat, allocation_runs=max(1, min(10, 100000 // size)))
+    del operation, reset
+    gc.collect()
+    return result
+
+
+def format_seconds(value):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if value >= scale:
+            return f"{value / scale:.2f}{unit}"
+    return f"{value / 1e-9:.0f}ns"
+
+
+def format_bytes(value):
+    for unit, scale in (("MiB", 2 ** 20), ("KiB", 2 ** 10)):
+        if abs(value) >= scale:
+            return f"{value / scale:.1f}{unit}"
+    return f"{value:.0f}B"
+
+
+def compare(results, baseline, margin):
+    """Return a description of every result that is worse than the baseline by more than `margin`."""
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        expected = baseline[key]
+        if result["ops_per_sec"] < expected["ops_per_sec"] * (1 - margin):
+            regressions.append(f"{key}: {result['ops_per_sec']:.1f} ops/s, baseline {expected['ops_per_sec']:.1f}")
+        # Ignore small absolute differences, tracemalloc's own bookkeeping moves by a few KiB
+        if result["peak_bytes"] > expected["peak_bytes"] * (1 + margin) + 16 * 1024:
+            regressions.append(f"{key}: peak {format_bytes(result['peak_bytes'])}, "
+                               f"baseline {format_bytes(expected['peak_bytes'])}")
+    return regressions
+
+
+def main():
+    args = parse_arguments()
+    sizes = [int(size) for size in args.sizes.split(",")]
+    names = args.benchmarks.split(",")
+    for name in names:
+        if name not in BENCHMARKS:
+            sys.exit(f"Unknown benchmark {name}, choose from {', '.join(BENCHMARKS)}")
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)["results"]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_file = os.path.join(temp_dir, "bench_data.json")
+        for name in names:
+            print(f"{name}:")
+            print(f"  {'size':>9}  {'ops/s':>11}  {'time/op':>9}  {'peak':>10}  {'retained/op':>11}  {'vs baseline':>11}")
+            for size in sizes:
+                key = f"{name}/{size}"
+                result = run_benchmark(name, size, args.min_time, args.repeat, data_file)
+                results[key] = result
+                change = "-"
+                if key in baseline:
+                    change = f"{result['ops_per_sec'] / baseline[key]['ops_per_sec'] - 1:+.0%}"
+                print(f"  {size:>9}  {result['ops_per_sec']:>11.1f}  {format_seconds(result['sec_per_op']):>9}  "
+                      f"{format_bytes(result['peak_bytes']):>10}  {format_bytes(result['retained_bytes_per_op']):>11}  "
+                      f"{change:>11}")
+
+    report = {"python": sys.version.split()[0], "created": time.strftime("%Y-%m-%d %H:%M:%S"), "results": results}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(report, file, indent=4)
+        print(f"\nBaseline saved to {args.baseline}")
+        return
+
+    regressions = compare(results, baseline, args.margin)
+    if regressions:
+        print(f"\nRegressions beyond {args.margin:.0%}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    if baseline:
+        print(f"\nNo regressions beyond {args.margin:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import socket
+import struct
+import threading
+import time
+
+# Trace file layout: MAGIC followed by records of RECORD_HEADER + payload bytes.
+MAGIC = b"P2PCAP1\n"
+RECORD_HEADER = struct.Struct("!dBB4sHI")  # timestamp, direction, transport, ipv4, port, payload length
+
+INBOUND = 0  # Received on one of the server's listeners
+OUTBOUND = 1  # Sent by the server
+RESPONSE = 2  # Reply received on a connection the server opened
+
+TRANSPORTS = {"UDP": 0, "TCP": 1}
+TRANSPORT_NAMES = {value: name for name, value in TRANSPORTS.items()}
+
+
+class TraceRecord:
+    def __init__(self, timestamp, direction, transport, ip, port, payload):
+        self.timestamp = timestamp
+        self.direction = direction
+        self.transport = transport
+        self.ip = ip
+        self.port = port
+        self.payload = payload
+
+    def address(self):
+        return (self.ip, self.port)
+
+    def message(self):
+        return self.payload.decode(errors="replace")
+
+
+class CaptureWriter:
+    """Append every captured message to a compact binary trace file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.file.flush()
+
+    def record(self, direction, transport, address, payload):
+        """Record one message. `address` is the remote (ip, port) of the peer."""
+        if isinstance(payload, str):
+            payload = payload.encode()
+        ip, port = address[0], int(address[1])
+        try:
+            packed_ip = socket.inet_aton(ip)
+        except OSError:
+            packed_ip = socket.inet_aton("0.0.0.0")
+        header = RECORD_HEADER.pack(time.time(), direction, TRANSPORTS[transport], packed_ip, port, len(payload))
+        with self.lock:
+            self.file.write(header)
+            self.file.write(payload)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def read_trace(path):
+    """Load all records from a trace file written by CaptureWriter."""
+    records = []
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a P2P capture file")
+        while True:
+            header = file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                break  # End of file (a truncated trailing record is ignored)
+            timestamp, direction, transport, packed_ip, port, length = RECORD_HEADER.unpack(header)
+            payload = file.read(length)
+            if len(payload) < length:
+                break
+            records.append(TraceRecord(timestamp, direction, TRANSPORT_NAMES[transport],
+                                       socket.inet_ntoa(packed_ip), port, payload))
+    return records
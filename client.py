@@ -2,6 +2,10 @@ import socket
 import random
 import threading
 import time
+import argparse
+
+from multicast import join_group
+from seller_rules import load_seller_rules
 
 input_lock = threading.Lock()
 out_lock = threading.Lock()
@@ -12,11 +16,28 @@ def generate_rq():
 
 def start_client():
     global registered
+
+    def parse_arguments():
+        parser = argparse.ArgumentParser(description="P2P Shopping Client")
+        parser.add_argument("--server_ip", type=str, default=None, help="Server IP address (asked if not given)")
+        parser.add_argument("--server_port", type=int, default=5000, help="Server UDP port number")
+        parser.add_argument("--name", type=str, default=None, help="Name to register with (asked if not given)")
+        parser.add_argument("--inventory", type=str, default=None,
+                            help="Inventory file with pricing rules and profile, to answer the server automatically")
+        parser.add_argument("--headless", action="store_true",
+                            help="Register and answer automatically from the inventory, without the command menu")
+        return parser.parse_args()
+
+    args = parse_arguments()
+    if args.headless and not (args.server_ip and args.name and args.inventory):
+        raise SystemExit("--headless requires --server_ip, --name and --inventory")
+
     with input_lock:
 
-        server_ip = input("Enter the server IP address: ")
-        server_port = 5000
+        server_ip = args.server_ip or input("Enter the server IP address: ")
+        server_port = args.server_port
         buffer_size = 1024
+        seller_rules = load_seller_rules(args.inventory) if args.inventory else None
 
         client_ip = socket.gethostbyname(socket.gethostname())
 
@@ -47,53 +68,85 @@ def start_client():
                 print("help      (h) - Show this help message")
                 print("quit      (q) - Exit the client\n")
 
-    def listen_for_messages():
+    def listen_for_messages(listen_socket):
         """Continuously listen for incoming messages from the server."""
         while True:
-            response, server_address = c_socket.recvfrom(buffer_size)
-            response = response.decode()
-            print(f"\nReceived message from server: {response}\nEnter command:")
+            response, server_address = listen_socket.recvfrom(buffer_size)
+            handle_server_message(response.decode())
 
-            parts = response.split()
-            if not parts:
-                continue
+    def handle_server_message(response):
+        print(f"\nReceived message from server: {response}\nEnter command:")
 
-            command = parts[0]
+        parts = response.split()
+        if not parts:
+            return
 
-            if command == "SEARCH":
-                rq = parts[1]
-                item_name = parts[2]
-                description = parts[3]
-                print(f"\nServer is searching for: {item_name} (Description: {description})")
+        command = parts[0]
+
+        if command == "SEARCH":
+            rq = parts[1]
+            item_name = parts[2]
+            description = parts[3]
+            if len(parts) > 4 and parts[4] == client_name:
+                return  # Our own search, delivered through the multicast group
+            print(f"\nServer is searching for: {item_name} (Description: {description})")
+            price = seller_rules.offer_price(item_name) if seller_rules else None
+            if price is not None:
+                offer_message = f"OFFER {rq} {client_name} {item_name} {price}"
+                c_socket.sendto(offer_message.encode(), (server_ip, server_port))
+                print(f"Auto-sent OFFER for {item_name} with price {price}")
+            else:
                 pending_search_requests[rq] = (item_name, description)
 
-            elif command == "NEGOTIATE":
-                rq = parts[1]
-                item_name = parts[2]
-                max_price = parts[3]
-                print(f"\nNegotiation request received for {item_name} with max price {max_price}")
+        elif command == "NEGOTIATE":
+            rq = parts[1]
+            item_name = parts[2]
+            max_price = parts[3]
+            print(f"\nNegotiation request received for {item_name} with max price {max_price}")
+            if seller_rules and seller_rules.handles(item_name):
+                reply = "ACCEPT" if seller_rules.accept(rq, item_name, max_price) else "REFUSE"
+                reply_message = f"{reply} {rq} {client_name} {item_name} {max_price}"
+                c_socket.sendto(reply_message.encode(), (server_ip, server_port))
+                print(f"Auto-sent {reply} for {item_name} at negotiated price {max_price}")
+            else:
                 pending_negotiations[rq] = (item_name, max_price)
 
-            elif command == "FOUND":
-                rq = parts[1]
-                item_name = parts[2]
-                price = parts[3]
-                print(
-                    f"\nFOUND: The item '{item_name}' is available at price {price}. You may proceed with the purchase.")
-                pending_reservations[rq] = (item_name, price)
-
-            elif command == "NOT_FOUND":
-                rq = parts[1]
-                item_name = parts[2]
-                max_price = parts[3]
-                print(f"\nNOT_FOUND: The item '{item_name}' is not available at the max price {max_price}.")
-
-            elif command == "RESERVE":
-                rq = parts[1]
-                item_name = parts[2]
-                price = parts[3]
-                print(f"\nRESERVE: You have reserved the item '{item_name}' at price {price}. Awaiting buyer's action.")
-                pending_reservations[rq] = (item_name, price)
+        elif command == "FOUND":
+            rq = parts[1]
+            item_name = parts[2]
+            price = parts[3]
+            print(
+                f"\nFOUND: The item '{item_name}' is available at price {price}. You may proceed with the purchase.")
+            pending_reservations[rq] = (item_name, price)
+
+        elif command == "NOT_FOUND":
+            rq = parts[1]
+            item_name = parts[2]
+            max_price = parts[3]
+            print(f"\nNOT_FOUND: The item '{item_name}' is not available at the max price {max_price}.")
+
+        elif command == "RESERVE":
+            rq = parts[1]
+            item_name = parts[2]
+            price = parts[3]
+            print(f"\nRESERVE: You have reserved the item '{item_name}' at price {price}. Awaiting buyer's action.")
+            pending_reservations[rq] = (item_name, price)
+            if seller_rules and seller_rules.handles(item_name) and not seller_rules.reserve(rq, item_name):
+                print(f"Warning: no unit of '{item_name}' left to hold for {rq}, it was offered to several buyers.")
+
+        elif command == "CANCEL":
+            rq = parts[1]
+            print(f"\nCANCEL: The reservation {rq} was canceled by the buyer.")
+            pending_reservations.pop(rq, None)
+            if seller_rules:
+                seller_rules.release(rq)
+
+        elif command == "BUSY":
+            rq = parts[1]
+            busy_command = parts[2]
+            retry_after = parts[3]
+            print(f"\nBUSY: The server is busy and did not process {busy_command} {rq}. "
+                  f"Retry after {retry_after} seconds.")
 
     def start_tcp_listener():
         """Start a TCP server to handle incoming messages from the server."""
@@ -110,7 +163,16 @@ def start_client():
         """Handle incoming TCP messages."""
         try:
             message = conn.recv(buffer_size).decode()
-            if message.startswith("INFORM_Req"):
+            if message.startswith("INFORM_Req") and seller_rules and seller_rules.profile:
+                # Answer from the stored profile instead of asking
+                rq = message.split()[1]
+                profile = seller_rules.profile
+                response = (f"INFORM_Res {rq} {client_name} {profile['cc_number']} {profile['cc_expiry']} "
+                            f"{profile['address']}")
+                conn.sendall(response.encode())
+                print(f"\nTransaction information for {rq} sent to the server from the stored profile.")
+
+            elif message.startswith("INFORM_Req"):
 
                 transaction_flag.set()
                 # Parse the INFORM_Req message
@@ -145,6 +207,14 @@ def start_client():
                 address = parts[3]
 
                 print(f"\nShipping address for the buyer is: {address}")
+                if seller_rules:
+                    seller_rules.sold(parts[1])
+
+            elif message.startswith("CANCEL"):
+                rq = message.split()[1]
+                print(f"\nTransaction {rq} was canceled by the server.")
+                if seller_rules:
+                    seller_rules.release(rq)
 
         except Exception as e:
             print(f"Error handling TCP transaction: {e}")
@@ -157,7 +227,7 @@ def start_client():
 
         while not registered:
             print("\n=== Registration ===")
-            client_name = input("Enter your name: ")
+            client_name = args.name or input("Enter your name: ")
 
             client_udp_port = random.randint(5500, 9999)
             client_tcp_port = random.randint(5500, 9999)
@@ -183,9 +253,14 @@ def start_client():
                 registered = True
                 print("Registration successful.")
                 # Start the listener threads
-                listener_thread = threading.Thread(target=listen_for_messages, daemon=True)
+                listener_thread = threading.Thread(target=listen_for_messages, args=(c_socket,), daemon=True)
                 listener_thread.start()
 
+                # The server may invite us to receive SEARCH messages through a multicast group
+                parts = response_message.split()
+                if len(parts) >= 4:
+                    join_multicast(parts[2], int(parts[3]), rq)
+
                 tcp_listener_thread = threading.Thread(target=start_tcp_listener, daemon=True)
                 tcp_listener_thread.start()
                 return True  # Exit loop and indicate success
@@ -194,7 +269,27 @@ def start_client():
                 print("Registration denied. User already exists. Please try again.")
                 print("Hint: Choose a unique name or different port numbers.")
                 c_socket.close()  # Close the current socket to allow re-registration
+                if args.name:
+                    return False  # The name was given on the command line, asking again won't help
                 continue  # Restart the registration loop
+            elif response_message.startswith("BUSY"):
+                # Registration throttled by the server
+                retry_after = float(response_message.split()[3])
+                print(f"Server is busy. Retrying in {retry_after} seconds.")
+                c_socket.close()
+                time.sleep(retry_after)
+                continue
+
+    def join_multicast(group, port, rq):
+        """Join the server's multicast group so each SEARCH arrives as a single datagram for all peers."""
+        try:
+            m_socket = join_group(group, port, client_ip)
+        except OSError as e:
+            print(f"Could not join multicast group {group}:{port} ({e}). SEARCH messages will be sent directly.")
+            return
+        threading.Thread(target=listen_for_messages, args=(m_socket,), daemon=True).start()
+        c_socket.sendto(f"MULTICAST_JOINED {rq} {client_name}".encode(), (server_ip, server_port))
+        print(f"Joined multicast group {group}:{port}")
 
     def deregister():
         global registered
@@ -320,8 +415,7 @@ def start_client():
 
     def handle_command(command, registered):
         if not registered and command in ["register", "r"]:
-            register()
-            return True
+            return register()
         elif not registered:
             print("You must register first.")
             return False
@@ -368,6 +462,14 @@ def start_client():
         # if c_socket:
         #     c_socket.close()
 
+    if args.headless:
+        # Seller mode: no menu, every message is answered from the inventory
+        if register():
+            print(f"Answering automatically from {args.inventory}. Press Ctrl+C to exit.")
+            while True:
+                time.sleep(3600)
+        return
+
     threading.Thread(target=main_loop, args=[transaction_flag, ], daemon=False).start()
 
 
@@ -0,0 +1,32 @@
+import bisect
+import hashlib
+
+
+def parse_peers(spec):
+    """Parse "node2=127.0.0.1:5010,node3=127.0.0.1:5020" into {node_id: (ip, udp_port)}."""
+    peers = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        node_id, _, address = entry.partition("=")
+        ip, _, port = address.rpartition(":")
+        peers[node_id.strip()] = (ip, int(port))
+    return peers
+
+
+def hash_key(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring mapping client names to server nodes.
+
+    Each node is placed on the ring `replicas` times so clients spread evenly, and adding or
+    removing a node only moves the clients that hashed to it.
+    """
+
+    def __init__(self, nodes, replicas=64):
+        self.ring = sorted((hash_key(f"{node}#{i}"), node) for node in nodes for i in range(replicas))
+        self.hashes = [point for point, node in self.ring]
+
+    def node_for(self, key):
+        index = bisect.bisect(self.hashes, hash_key(key)) % len(self.ring)
+        return self.ring[index][1]
@@ -0,0 +1,27 @@
+import socket
+import struct
+
+
+def join_group(group, port, interface_ip="0.0.0.0"):
+    """Open a UDP socket that receives datagrams sent to a multicast group."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Several peers may share a host
+    try:
+        sock.bind((group, port))  # Only receive traffic for the group (Linux, macOS)
+    except OSError:
+        sock.bind(("", port))  # Windows can't bind to a multicast address
+    membership = struct.pack("4s4s", socket.inet_aton(group), socket.inet_aton(interface_ip))
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def configure_sender(sock, interface_ip=None, ttl=1):
+    """Prepare a UDP socket for sending to multicast groups."""
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)  # Deliver to peers on this host too
+    if interface_ip and interface_ip != "0.0.0.0":
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface_ip))
@@ -0,0 +1,260 @@
+"""Asyncio client library for the P2P Shopping server.
+
+Example:
+    client = AsyncClient("127.0.0.1", profile={"cc_number": "4111111111111111", "cc_expiry": "12/27",
+                                               "address": "1455_De_Maisonneuve"})
+    await client.start()
+    await client.register("alice")
+    result = await client.search("lamp", "red", 50)
+    if result.status == "FOUND":
+        await client.buy(result.rq, result.item_name, result.price)
+    await client.close()
+
+Replies are matched to the waiting call by request number (rq). Every call that waits for a reply holds
+one of `max_pending` slots, so the memory used by pending state stays bounded however many calls are made.
+A request the server throttles with BUSY is sent again after the delay it asks for, up to `busy_retries` times.
+"""
+import asyncio
+import itertools
+import random
+from collections import namedtuple
+
+SearchResult = namedtuple("SearchResult", ["rq", "status", "item_name", "price"])
+
+# Server replies and the request they answer
+REPLY_TO = {
+    "REGISTERED": "REGISTER",
+    "REGISTER-DENIED": "REGISTER",
+    "DE-REGISTERED": "DE-REGISTER",
+    "DE-REGISTER-FAILED": "DE-REGISTER",
+    "LOOKING_FOR_ACK": "LOOKING_FOR",
+    "FOUND": "RESULT",
+    "NOT_FOUND": "RESULT",
+}
+
+# Messages that aren't replies to one of our requests, delivered through AsyncClient.events
+EVENTS = {"SEARCH", "NEGOTIATE", "RESERVE", "CANCEL", "Shipping_Info"}
+
+
+class ServerBusy(Exception):
+    def __init__(self, command, retry_after):
+        super().__init__(f"Server is busy, {command} can be retried after {retry_after} seconds")
+        self.command = command
+        self.retry_after = retry_after
+
+
+class RegistrationError(Exception):
+    pass
+
+
+class _UDPProtocol(asyncio.DatagramProtocol):
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        self.client.handle_message(data.decode(errors="replace"))
+
+
+class AsyncClient:
+    def __init__(self, server_ip, server_port=5000, client_ip="127.0.0.1", profile=None, max_pending=1000,
+                 max_events=1000, reply_timeout=5.0, busy_retries=10):
+        self.server_address = (server_ip, server_port)
+        self.client_ip = client_ip
+        self.profile = profile or {}
+        self.reply_timeout = reply_timeout
+        self.busy_retries = busy_retries  # 0 raises ServerBusy at once
+        self.name = None
+        self.transport = None
+        self.tcp_server = None
+        self.udp_port = None
+        self.tcp_port = None
+        self.pending = {}  # (request, rq) -> future
+        self.slots = asyncio.Semaphore(max_pending)
+        self.events = asyncio.Queue(maxsize=max_events)
+        self.dropped_events = 0
+        self.rq_counter = itertools.count()
+        self.rq_prefix = random.randint(1000, 9999)
+
+    async def start(self):
+        """Open the UDP socket and the TCP listener used for transactions."""
+        loop = asyncio.get_running_loop()
+        self.transport, protocol = await loop.create_datagram_endpoint(lambda: _UDPProtocol(self),
+                                                                       local_addr=(self.client_ip, 0))
+        self.udp_port = self.transport.get_extra_info("sockname")[1]
+        self.tcp_server = await asyncio.start_server(self.handle_tcp_connection, self.client_ip, 0)
+        self.tcp_port = self.tcp_server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self.transport:
+            self.transport.close()
+        if self.tcp_server:
+            self.tcp_server.close()
+            await self.tcp_server.wait_closed()
+        for future in self.pending.values():
+            future.cancel()
+
+    def generate_rq(self):
+        """Request numbers unique within this process (the interactive client picks them at random)."""
+        return f"RQ{self.rq_prefix}{next(self.rq_counter)}"
+
+    def send(self, message):
+        self.transport.sendto(message.encode(), self.server_address)
+
+    def expect(self, request, rq):
+        future = asyncio.get_running_loop().create_future()
+        self.pending[(request, rq)] = future
+        return future
+
+    async def wait(self, request, rq, future, timeout):
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop((request, rq), None)
+
+    def resolve(self, request, rq, result=None, exception=None):
+        future = self.pending.get((request, rq))
+        if future is None or future.done():
+            return  # Late or unexpected reply
+        if exception:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def handle_message(self, message):
+        parts = message.split()
+        if len(parts) < 2:
+            return
+        command, rq = parts[0], parts[1]
+
+        if command in REPLY_TO:
+            self.resolve(REPLY_TO[command], rq, parts)
+        elif command == "BUSY":
+            busy_command, retry_after = parts[2], float(parts[3])
+            request = "INFORM" if busy_command == "BUY" else busy_command  # BUY waits for INFORM_Req first
+            self.resolve(request, rq, exception=ServerBusy(busy_command, retry_after))
+        elif command in EVENTS:
+            self.push_event(parts)
+
+    def push_event(self, parts):
+        """Queue an unsolicited message, dropping the oldest one if nobody is reading the queue."""
+        if self.events.full():
+            self.events.get_nowait()
+            self.dropped_events += 1
+        self.events.put_nowait(parts)
+
+    async def handle_tcp_connection(self, reader, writer):
+        try:
+            message = (await reader.read(1024)).decode(errors="replace")
+            parts = message.split()
+            if not parts:
+                return
+            if parts[0] == "INFORM_Req":
+                profile = self.profile
+                response = (f"INFORM_Res {parts[1]} {self.name} {profile.get('cc_number', '-')} "
+                            f"{profile.get('cc_expiry', '-')} {profile.get('address', '-')}")
+                writer.write(response.encode())
+                await writer.drain()
+                self.resolve("INFORM", parts[1], parts)
+            elif parts[0] == "CANCEL":
+                self.resolve("TRANSACTION", parts[1], "CANCELED")
+                self.push_event(parts)
+            else:
+                self.push_event(parts)
+        finally:
+            writer.close()
+
+    async def retry_busy(self, attempt):
+        """Await `attempt()`, calling it again after the server's retry_after each time it raises ServerBusy.
+
+        The slot is released while waiting, so throttled calls don't hold up others.
+        """
+        for retries in itertools.count():
+            try:
+                return await attempt()
+            except ServerBusy as busy:
+                if retries >= self.busy_retries:
+                    raise
+                await asyncio.sleep(busy.retry_after)
+
+    async def request(self, request, message_parts, timeout=None):
+        """Send a request and wait for the reply with the same rq."""
+        return await self.retry_busy(lambda: self.request_once(request, message_parts, timeout))
+
+    async def request_once(self, request, message_parts, timeout=None):
+        async with self.slots:
+            rq = self.generate_rq()
+            reply = self.expect(request, rq)
+            self.send(" ".join([request, rq, *message_parts]))
+            return await self.wait(request, rq, reply, timeout or self.reply_timeout)
+
+    async def register(self, name):
+        self.name = name
+        reply = await self.request("REGISTER", [name, self.client_ip, str(self.udp_port), str(self.tcp_port)])
+        if reply[0] != "REGISTERED":
+            raise RegistrationError(" ".join(reply[2:]) or reply[0])
+
+    async def deregister(self):
+        reply = await self.request("DE-REGISTER", [self.name])
+        if reply[0] != "DE-REGISTERED":
+            raise RegistrationError(" ".join(reply[2:]) or reply[0])
+
+    async def search(self, item_name, description, max_price, timeout=150.0):
+        """Search for an item. Returns a SearchResult with status FOUND, NOT_FOUND or TIMEOUT.
+
+        The server doesn't answer a search that got no offers at all, so that case ends in TIMEOUT.
+        """
+        return await self.retry_busy(lambda: self.search_once(item_name, description, max_price, timeout))
+
+    async def search_once(self, item_name, description, max_price, timeout=150.0):
+        async with self.slots:
+            rq = self.generate_rq()
+            # The result can arrive before the acknowledgement, so expect both before sending
+            ack = self.expect("LOOKING_FOR", rq)
+            result = self.expect("RESULT", rq)
+            try:
+                self.send(f"LOOKING_FOR {rq} {self.name} {item_name} {description} {max_price}")
+                await self.wait("LOOKING_FOR", rq, ack, self.reply_timeout)
+                reply = await self.wait("RESULT", rq, result, timeout)
+            except asyncio.TimeoutError:
+                return SearchResult(rq, "TIMEOUT", item_name, None)
+            finally:
+                self.pending.pop(("RESULT", rq), None)
+            return SearchResult(rq, reply[0], reply[2], reply[3])
+
+    async def offer(self, rq, item_name, price):
+        self.send(f"OFFER {rq} {self.name} {item_name} {price}")
+
+    async def accept(self, rq, item_name, price):
+        self.send(f"ACCEPT {rq} {self.name} {item_name} {price}")
+
+    async def refuse(self, rq, item_name, price):
+        self.send(f"REFUSE {rq} {self.name} {item_name} {price}")
+
+    async def cancel(self, rq, item_name, price):
+        self.send(f"CANCEL {rq} {self.name} {item_name} {price}")
+
+    async def buy(self, rq, item_name, price, timeout=300.0, settle_time=5.0):
+        """Buy a reserved item. Returns CANCELED or UNCONFIRMED.
+
+        The server asks for payment details (answered from `profile`) and only tells the buyer when the
+        transaction is canceled, never when it completes. If no CANCEL arrives within `settle_time` seconds of
+        the payment details being sent, the purchase is UNCONFIRMED: the server may still be waiting on the seller
+        (up to its 300-second TCP timeout) and cancel afterwards. A later CANCEL is delivered through `events`.
+        """
+        return await self.retry_busy(lambda: self.buy_once(rq, item_name, price, timeout, settle_time))
+
+    async def buy_once(self, rq, item_name, price, timeout=300.0, settle_time=5.0):
+        async with self.slots:
+            inform = self.expect("INFORM", rq)
+            outcome = self.expect("TRANSACTION", rq)
+            try:
+                self.send(f"BUY {rq} {self.name} {item_name} {price}")
+                await self.wait("INFORM", rq, inform, timeout)
+                return await self.wait("TRANSACTION", rq, outcome, settle_time)
+            except asyncio.TimeoutError:
+                if inform.done() and not inform.cancelled():
+                    return "UNCONFIRMED"  # Payment details were sent and nothing was canceled yet
+                raise
+            finally:
+                self.pending.pop(("INFORM", rq), None)
+                self.pending.pop(("TRANSACTION", rq), None)
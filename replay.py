@@ -0,0 +1,308 @@
+import socket
+import threading
+import time
+import argparse
+
+from capture import read_trace, INBOUND, OUTBOUND, RESPONSE
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Replay a P2P Shopping server capture against a server")
+    parser.add_argument("trace_file", type=str, help="Trace file recorded with server.py --capture_file")
+    parser.add_argument("--server_ip", type=str, default="127.0.0.1", help="Server IP address")
+    parser.add_argument("--udp_port", type=int, default=5000, help="Server UDP port number")
+    parser.add_argument("--tcp_port", type=int, default=5001, help="Server TCP port number")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Replay speed multiplier (1 = recorded pace, 0 = as fast as possible)")
+    parser.add_argument("--wait", type=float, default=2.0, help="Seconds to wait for replies after the last send")
+    parser.add_argument("--buffer_size", type=int, default=1024, help="Buffer size for socket communication")
+    return parser.parse_args()
+
+
+def message_key(message):
+    """Return (command, rq) for a protocol message, or None if it can't be parsed."""
+    parts = message.split()
+    if len(parts) < 2:
+        return None
+    return parts[0], parts[1]
+
+
+def first_reply(replies, rq, after):
+    """Find the first reply carrying `rq` received at or after `after`. Returns (latency, command)."""
+    for timestamp, message in replies:
+        key = message_key(message)
+        if key and key[1] == rq and timestamp >= after:
+            return timestamp - after, key[0]
+    return None, None
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def format_ms(value):
+    return "-" if value is None else f"{value * 1000:.1f}ms"
+
+
+class SimulatedPeer:
+    """A UDP socket on localhost standing in for one recorded source address.
+
+    A peer that registered in the recording also gets a TCP listener. It answers INFORM_Req with the response
+    recorded for the same rq.
+    """
+
+    def __init__(self, original_address, local_ip, buffer_size, original_tcp_port=None, tcp_responses=None):
+        self.original_address = original_address
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self.socket.bind((local_ip, original_address[1]))
+        except OSError:
+            # The recorded port is taken, let the OS pick one
+            self.socket.bind((local_ip, 0))
+        self.address = self.socket.getsockname()
+        self.buffer_size = buffer_size
+        self.replies = []
+        self.running = True
+        threading.Thread(target=self.listen, daemon=True).start()
+
+        self.original_tcp_port = original_tcp_port
+        self.tcp_responses = tcp_responses or {}  # rq -> recorded INFORM_Res payload
+        self.tcp_received = []  # (time, message) sent by the server over TCP
+        self.tcp_socket = None
+        if original_tcp_port is not None:
+            self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                self.tcp_socket.bind((local_ip, original_tcp_port))
+            except OSError:
+                self.tcp_socket.bind((local_ip, 0))
+            self.tcp_socket.listen(5)
+            self.tcp_address = self.tcp_socket.getsockname()
+            threading.Thread(target=self.serve_tcp, daemon=True).start()
+
+    def listen(self):
+        while self.running:
+            try:
+                message, server_address = self.socket.recvfrom(self.buffer_size)
+            except OSError:
+                break
+            self.replies.append((time.time(), message.decode(errors="replace")))
+
+    def serve_tcp(self):
+        while self.running:
+            try:
+                conn, server_address = self.tcp_socket.accept()
+            except OSError:
+                break
+            with conn:
+                message = conn.recv(self.buffer_size).decode(errors="replace")
+                self.tcp_received.append((time.time(), message))
+                key = message_key(message)
+                if key and key[0] == "INFORM_Req" and key[1] in self.tcp_responses:
+                    conn.sendall(self.tcp_responses[key[1]])
+
+    def rewrite(self, message):
+        """Point the addresses advertised in a REGISTER message at this simulated peer."""
+        parts = message.split()
+        if len(parts) == 6 and parts[0] == "REGISTER":
+            parts[3] = self.address[0]
+            if parts[4] == str(self.original_address[1]):
+                parts[4] = str(self.address[1])
+            if self.tcp_socket and parts[5] == str(self.original_tcp_port):
+                parts[5] = str(self.tcp_address[1])
+            return " ".join(parts)
+        return message
+
+    def close(self):
+        self.running = False
+        self.socket.close()
+        if self.tcp_socket:
+            self.tcp_socket.close()
+
+
+def local_ip_for(original_ip, local_ips):
+    """Map every recorded source IP to a distinct loopback address."""
+    if original_ip not in local_ips:
+        if original_ip.startswith("127."):
+            local_ips[original_ip] = original_ip
+        else:
+            index = len(local_ips)
+            local_ips[original_ip] = f"127.0.{1 + index // 254}.{1 + index % 254}"
+    return local_ips[original_ip]
+
+
+def recorded_replies(records):
+    """Group the server's recorded UDP replies by destination address."""
+    replies = {}
+    for record in records:
+        if record.direction == OUTBOUND and record.transport == "UDP":
+            replies.setdefault(record.address(), []).append((record.timestamp, record.message()))
+    return replies
+
+
+def registered_tcp_endpoints(inbound):
+    """Map each UDP source address that sent a REGISTER to the (ip, tcp_port) it advertised."""
+    endpoints = {}
+    for record in inbound:
+        parts = record.message().split()
+        if record.transport == "UDP" and len(parts) == 6 and parts[0] == "REGISTER" and parts[5].isdigit():
+            endpoints[record.address()] = (parts[3], int(parts[5]))
+    return endpoints
+
+
+def recorded_tcp_traffic(records, direction):
+    """Group the TCP messages the server sent (OUTBOUND) or got back (RESPONSE) by peer address."""
+    traffic = {}
+    for record in records:
+        if record.direction == direction and record.transport == "TCP":
+            traffic.setdefault(record.address(), []).append(record)
+    return traffic
+
+
+def replay(args):
+    records = read_trace(args.trace_file)
+    inbound = [record for record in records if record.direction == INBOUND]
+    if not inbound:
+        print("No inbound messages in trace.")
+        return
+
+    tcp_endpoints = registered_tcp_endpoints(inbound)
+    responses = recorded_tcp_traffic(records, RESPONSE)
+    local_ips = {}
+    peers = {}
+    tcp_peers = {}  # Recorded (ip, tcp_port) -> peer standing in for it
+    for record in inbound:
+        if record.transport == "UDP" and record.address() not in peers:
+            local_ip = local_ip_for(record.ip, local_ips)
+            tcp_endpoint = tcp_endpoints.get(record.address())
+            if tcp_endpoint:
+                tcp_responses = {message_key(response.message())[1]: response.payload
+                                 for response in responses.get(tcp_endpoint, []) if message_key(response.message())}
+                peer = SimulatedPeer(record.address(), local_ip, args.buffer_size, tcp_endpoint[1], tcp_responses)
+                tcp_peers[tcp_endpoint] = peer
+            else:
+                peer = SimulatedPeer(record.address(), local_ip, args.buffer_size)
+            peers[record.address()] = peer
+    print(f"Replaying {len(inbound)} messages from {len(peers)} simulated peers at "
+          f"{'max' if args.speed <= 0 else f'{args.speed:g}x'} speed")
+
+    server_udp = (args.server_ip, args.udp_port)
+    server_tcp = (args.server_ip, args.tcp_port)
+    first_timestamp = inbound[0].timestamp
+    start = time.time()
+    sent_at = []
+
+    for record in inbound:
+        if args.speed > 0:
+            delay = start + (record.timestamp - first_timestamp) / args.speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+        if record.transport == "UDP":
+            peer = peers[record.address()]
+            peer.socket.sendto(peer.rewrite(record.message()).encode(), server_udp)
+        else:
+            try:
+                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as tcp_socket:
+                    tcp_socket.settimeout(5)
+                    tcp_socket.connect(server_tcp)
+                    tcp_socket.sendall(record.payload)
+            except OSError as e:
+                print(f"Error replaying TCP message: {e}")
+        sent_at.append(time.time())
+
+    time.sleep(args.wait)
+    replay_duration = time.time() - start
+    for peer in peers.values():
+        peer.close()
+
+    report(records, inbound, sent_at, peers, tcp_peers, replay_duration)
+
+
+def tcp_outcomes(records, tcp_peers):
+    """Compare the TCP messages the server sent to each peer, per rq, in the recording and the replay.
+
+    Returns ({command: [recorded, replayed]}, list of differences).
+    """
+    counts = {}
+    differences = []
+    recorded_traffic = recorded_tcp_traffic(records, OUTBOUND)
+    for endpoint, peer in tcp_peers.items():
+        recorded = {}
+        for record in recorded_traffic.get(endpoint, []):
+            key = message_key(record.message())
+            if key:
+                recorded.setdefault(key[1], []).append(key[0])
+        replayed = {}
+        for timestamp, message in peer.tcp_received:
+            key = message_key(message)
+            if key:
+                replayed.setdefault(key[1], []).append(key[0])
+
+        for rq in sorted(set(recorded) | set(replayed)):
+            for command in recorded.get(rq, []):
+                counts.setdefault(command, [0, 0])[0] += 1
+            for command in replayed.get(rq, []):
+                counts.setdefault(command, [0, 0])[1] += 1
+            if recorded.get(rq) != replayed.get(rq):
+                differences.append(f"TCP {rq} to {endpoint[0]}:{endpoint[1]}: "
+                                   f"recorded {', '.join(recorded.get(rq, [])) or 'nothing'}, "
+                                   f"replayed {', '.join(replayed.get(rq, [])) or 'nothing'}")
+    return counts, differences
+
+
+def report(records, inbound, sent_at, peers, tcp_peers, replay_duration):
+    """Compare reply latency and outcome of each replayed message with the recorded run."""
+    recorded = recorded_replies(records)
+    stats = {}
+    mismatches = []
+
+    for record, replayed_at in zip(inbound, sent_at):
+        key = message_key(record.message())
+        if key is None or record.transport != "UDP":
+            continue
+        command, rq = key
+        entry = stats.setdefault(command, {"sent": 0, "recorded": [], "replayed": [], "mismatched": 0})
+        entry["sent"] += 1
+
+        recorded_latency, recorded_outcome = first_reply(recorded.get(record.address(), []), rq, record.timestamp)
+        replay_latency, replay_outcome = first_reply(peers[record.address()].replies, rq, replayed_at)
+        if recorded_latency is not None:
+            entry["recorded"].append(recorded_latency)
+        if replay_latency is not None:
+            entry["replayed"].append(replay_latency)
+        if recorded_outcome != replay_outcome:
+            entry["mismatched"] += 1
+            mismatches.append(f"{command} {rq}: recorded {recorded_outcome or 'no reply'}, "
+                              f"replayed {replay_outcome or 'no reply'}")
+
+    recorded_duration = inbound[-1].timestamp - inbound[0].timestamp
+    print(f"\nRecorded span: {recorded_duration:.2f}s, replay took: {replay_duration:.2f}s")
+    print(f"{'Command':<14}{'Sent':>6}{'Rec. replies':>14}{'Rec. p50':>11}{'Rec. p95':>11}"
+          f"{'Replies':>9}{'p50':>11}{'p95':>11}{'Differ':>8}")
+    for command, entry in sorted(stats.items()):
+        print(f"{command:<14}{entry['sent']:>6}{len(entry['recorded']):>14}"
+              f"{format_ms(percentile(entry['recorded'], 0.5)):>11}{format_ms(percentile(entry['recorded'], 0.95)):>11}"
+              f"{len(entry['replayed']):>9}"
+              f"{format_ms(percentile(entry['replayed'], 0.5)):>11}{format_ms(percentile(entry['replayed'], 0.95)):>11}"
+              f"{entry['mismatched']:>8}")
+
+    tcp_counts, tcp_differences = tcp_outcomes(records, tcp_peers)
+    if tcp_counts:
+        print("\nTCP messages from the server to peers:")
+        print(f"{'Command':<14}{'Recorded':>10}{'Replayed':>10}")
+        for command, (recorded_count, replayed_count) in sorted(tcp_counts.items()):
+            print(f"{command:<14}{recorded_count:>10}{replayed_count:>10}")
+    mismatches.extend(tcp_differences)
+
+    if mismatches:
+        print("\nOutcome differences:")
+        for mismatch in mismatches:
+            print(f" - {mismatch}")
+
+
+if __name__ == "__main__":
+    replay(parse_arguments())
@@ -0,0 +1,161 @@
+import json
+import queue
+import socket
+import threading
+import time
+
+
+class ReplicationPrimary:
+    """Stream server state changes to standby servers over TCP.
+
+    Every message is one line of JSON. A standby first receives a full snapshot, then one "op" per
+    changed entry (carrying the entry's new value, or null when it was deleted) and a heartbeat every
+    `heartbeat_interval` seconds. Ops are idempotent, so applying one twice is harmless.
+
+    Pass the lock the server holds while changing its state as `lock`, so a snapshot can't miss or race with a
+    change. It must be reentrant, the server publishes while holding it.
+    """
+
+    def __init__(self, server_ip, port, snapshot, heartbeat_interval=1.0, lock=None):
+        self.server_ip = server_ip
+        self.port = port
+        self.snapshot = snapshot
+        self.heartbeat_interval = heartbeat_interval
+        self.lock = lock or threading.RLock()
+        self.seq = 0
+        self.standbys = []  # One outgoing queue per connected standby
+
+    def start(self):
+        threading.Thread(target=self.accept_standbys, daemon=True).start()
+        threading.Thread(target=self.send_heartbeats, daemon=True).start()
+
+    def accept_standbys(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as listen_socket:
+            listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listen_socket.bind((self.server_ip, self.port))
+            listen_socket.listen(5)
+            print(f"Replication socket started {self.server_ip}:{self.port}")
+
+            while True:
+                conn, standby_address = listen_socket.accept()
+                self.add_standby(conn, standby_address)
+
+    def add_standby(self, conn, standby_address):
+        """Queue a snapshot for a new standby and start streaming to it."""
+        outgoing = queue.Queue()
+        try:
+            with self.lock:
+                # Taken under the lock so no op published meanwhile is missed
+                outgoing.put(self.encode({"type": "snapshot", "state": self.snapshot()}))
+                self.standbys.append(outgoing)
+        except Exception as e:
+            # Drop this standby only, it reconnects and gets a new snapshot
+            print(f"Error sending snapshot to standby {standby_address}: {e}")
+            conn.close()
+            return
+        print(f"Standby connected from {standby_address}")
+        threading.Thread(target=self.stream_to_standby, args=(conn, outgoing), daemon=True).start()
+
+    def stream_to_standby(self, conn, outgoing):
+        try:
+            with conn:
+                while True:
+                    conn.sendall(outgoing.get())
+        except OSError as e:
+            print(f"Standby disconnected: {e}")
+        finally:
+            with self.lock:
+                self.standbys.remove(outgoing)
+
+    def encode(self, message):
+        """Number and timestamp a message. Must be called with the lock held."""
+        self.seq += 1
+        message["seq"] = self.seq
+        message["ts"] = time.time()
+        return (json.dumps(message) + "\n").encode()
+
+    def publish(self, table, key, value):
+        with self.lock:
+            if not self.standbys:
+                return
+            line = self.encode({"type": "op", "table": table, "key": key, "value": value})
+            for outgoing in self.standbys:
+                outgoing.put(line)
+
+    def send_heartbeats(self):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            with self.lock:
+                if self.standbys:
+                    line = self.encode({"type": "heartbeat"})
+                    for outgoing in self.standbys:
+                        outgoing.put(line)
+
+
+class ReplicationStandby:
+    """Follow a primary's replication stream and call `on_failover` once the primary goes quiet."""
+
+    def __init__(self, primary_address, apply_snapshot, apply_op, on_failover, failover_timeout=3.0):
+        self.primary_address = primary_address
+        self.apply_snapshot = apply_snapshot
+        self.apply_op = apply_op
+        self.on_failover = on_failover
+        self.failover_timeout = failover_timeout
+        self.synced = False
+        self.failed_over = False
+        self.last_seq = 0
+        self.last_received = None
+        self.lag = None  # Seconds between the primary sending the last message and it being applied here
+
+    def start(self):
+        threading.Thread(target=self.follow, daemon=True).start()
+        threading.Thread(target=self.watch_primary, daemon=True).start()
+
+    def follow(self):
+        """Connect to the primary and apply its stream, reconnecting until a failover happens."""
+        while not self.failed_over:
+            try:
+                with socket.create_connection(self.primary_address, timeout=self.failover_timeout) as conn:
+                    conn.settimeout(None)
+                    print(f"Following primary at {self.primary_address[0]}:{self.primary_address[1]}")
+                    for line in conn.makefile("r"):
+                        if self.failed_over:
+                            return
+                        self.apply(json.loads(line))
+            except OSError as e:
+                if not self.synced:
+                    print(f"Waiting for primary at {self.primary_address[0]}:{self.primary_address[1]}: {e}")
+            time.sleep(0.5)
+
+    def apply(self, message):
+        received_at = time.time()
+        if message["type"] == "snapshot":
+            self.apply_snapshot(message["state"])
+        elif message["type"] == "op":
+            self.apply_op(message["table"], message["key"], message["value"])
+        self.last_seq = message["seq"]
+        self.last_received = received_at
+        self.lag = received_at - message["ts"]
+        if message["type"] == "snapshot":
+            self.synced = True  # Only once last_received is set, watch_primary reads it as soon as this is True
+            print(f"Received state snapshot at seq {message['seq']}")
+
+    def watch_primary(self):
+        while True:
+            time.sleep(0.1)
+            # Only take over from a primary we have synced with, never from one that hasn't started yet
+            last_received = self.last_received
+            if self.synced and last_received is not None and time.time() - last_received > self.failover_timeout:
+                self.failed_over = True
+                print(f"No heartbeat from primary for {self.failover_timeout}s, taking over.")
+                self.on_failover()
+                return
+
+    def metrics(self):
+        since_last = None if self.last_received is None else time.time() - self.last_received
+        return {
+            "synced": self.synced,
+            "last_seq": self.last_seq,
+            "lag_ms": None if self.lag is None else round(self.lag * 1000, 3),
+            "since_last_message_ms": None if since_last is None else round(since_last * 1000, 3),
+        }
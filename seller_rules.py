@@ -0,0 +1,78 @@
+import json
+import threading
+
+
+class SellerRules:
+    """Inventory, pricing rules and profile used to answer the server without user input.
+
+    Inventory file format:
+    {
+        "profile": {"cc_number": "4111111111111111", "cc_expiry": "12/27", "address": "1455_De_Maisonneuve"},
+        "items": {
+            "lamp": {"list_price": 45, "floor_price": 30, "quantity": 2}
+        }
+    }
+    Items are matched on name, ignoring case. A reserved item is held until the sale completes or is canceled.
+    """
+
+    def __init__(self, items, profile):
+        self.items = {name.lower(): dict(rules) for name, rules in items.items()}
+        self.profile = profile
+        self.reserved = {}  # rq -> item name
+        self.lock = threading.Lock()
+
+    def available(self, item_name):
+        """Number of units not sold or held by a reservation. Must be called with the lock held."""
+        rules = self.items.get(item_name.lower())
+        if rules is None:
+            return 0
+        held = sum(1 for reserved_item in self.reserved.values() if reserved_item == item_name.lower())
+        return rules["quantity"] - held
+
+    def offer_price(self, item_name):
+        """Price to offer for a SEARCH, or None if the item isn't in stock."""
+        with self.lock:
+            if self.available(item_name) <= 0:
+                return None
+            return self.items[item_name.lower()]["list_price"]
+
+    def accept(self, rq, item_name, price):
+        """Whether to ACCEPT a NEGOTIATE at `price`. An accepted item is held for `rq`.
+
+        The server doesn't send RESERVE after an ACCEPT, so the unit is held here.
+        """
+        with self.lock:
+            if self.available(item_name) <= 0 or float(price) < self.items[item_name.lower()]["floor_price"]:
+                return False
+            self.reserved[rq] = item_name.lower()
+            return True
+
+    def handles(self, item_name):
+        return item_name.lower() in self.items
+
+    def reserve(self, rq, item_name):
+        """Hold a unit for `rq`. Returns False if every unit is already sold or held."""
+        with self.lock:
+            if rq in self.reserved:
+                return True
+            if self.available(item_name) <= 0:
+                return False
+            self.reserved[rq] = item_name.lower()
+            return True
+
+    def release(self, rq):
+        """The reservation was canceled, the item is available again."""
+        with self.lock:
+            self.reserved.pop(rq, None)
+
+    def sold(self, rq):
+        with self.lock:
+            item_name = self.reserved.pop(rq, None)
+            if item_name:
+                self.items[item_name]["quantity"] -= 1
+
+
+def load_seller_rules(path):
+    with open(path, "r") as file:
+        data = json.load(file)
+    return SellerRules(data.get("items", {}), data.get("profile", {}))
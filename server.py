@@ -4,7 +4,18 @@ import time
 import json
 import os
 import argparse
+import copy
 import random
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from capture import CaptureWriter, INBOUND, OUTBOUND, RESPONSE
+from tracing import Tracer
+from admission import AdmissionController, parse_rate_limits
+from federation import HashRing, parse_peers
+from multicast import configure_sender
+from replication import ReplicationPrimary, ReplicationStandby
+from transport import SocketTransport, RealClock
 
 
 class Client:
@@ -28,106 +39,314 @@ class Client:
         return Client(data["name"], data["ip"], data["udp_port"], data["tcp_port"])
 
 
-def start_server():
-    global reservations
-
-    def parse_arguments():
-        parser = argparse.ArgumentParser(description="P2P Shopping Server")
-        parser.add_argument("--server_ip", type=str, default="0.0.0.0", help="Server IP address")
-        parser.add_argument("--udp_port", type=int, default=5000, help="UDP port number")
-        parser.add_argument("--tcp_port", type=int, default=5001, help="TCP port number")
-        parser.add_argument("--buffer_size", type=int, default=1024, help="Buffer size for socket communication")
-        parser.add_argument("--data_file", type=str, default="server_data.json", help="File to store server data")
-        return parser.parse_args()
-
-    args = parse_arguments()
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="P2P Shopping Server")
+    parser.add_argument("--server_ip", type=str, default="0.0.0.0", help="Server IP address")
+    parser.add_argument("--udp_port", type=int, default=5000, help="UDP port number")
+    parser.add_argument("--tcp_port", type=int, default=5001, help="TCP port number")
+    parser.add_argument("--buffer_size", type=int, default=1024, help="Buffer size for socket communication")
+    parser.add_argument("--data_file", type=str, default="server_data.json",
+                        help="File to store server data (empty to keep data in memory only)")
+    parser.add_argument("--log_file", type=str, default="server.log",
+                        help="File to log server actions to (empty to disable)")
+    parser.add_argument("--offer_timeout", type=float, default=120,
+                        help="Seconds to wait for offers before a search is evaluated")
+    parser.add_argument("--capture_file", type=str, default=None,
+                        help="Record all inbound and outbound messages to this binary trace file")
+    parser.add_argument("--trace_file", type=str, default=None,
+                        help="Write per-request spans to this file (Chrome trace event format)")
+    parser.add_argument("--trace_sample_rate", type=float, default=1.0,
+                        help="Fraction of requests (rq) to trace, between 0 and 1")
+    parser.add_argument("--rate_limits", type=str, default="REGISTER=1:5,LOOKING_FOR=0.2:5,BUY=0.5:5",
+                        help="Per-client limits as COMMAND=rate:burst,... (rate in requests per second)")
+    parser.add_argument("--max_searches", type=int, default=500,
+                        help="Maximum number of searches waiting for offers (0 for no limit)")
+    parser.add_argument("--backlog_watermark", type=int, default=200,
+                        help="Shed new work while this many messages are being handled (0 to disable)")
+    parser.add_argument("--stats_interval", type=int, default=60,
+                        help="Seconds between admission statistics reports")
+    parser.add_argument("--node_id", type=str, default="node1", help="Name of this node in a federation")
+    parser.add_argument("--peers", type=str, default="",
+                        help="Other federation nodes as NODE_ID=IP:UDP_PORT,... (empty to run standalone)")
+    parser.add_argument("--multicast_group", type=str, default=None,
+                        help="Multicast group (e.g. 239.255.36.6) to send SEARCH messages to, instead of "
+                             "one message per client")
+    parser.add_argument("--multicast_port", type=int, default=5100, help="UDP port of the multicast group")
+    parser.add_argument("--replication_port", type=int, default=None,
+                        help="TCP port on which standby servers can follow this server's state")
+    parser.add_argument("--standby_of", type=str, default=None,
+                        help="Run as a warm standby of the primary's replication port (IP:PORT)")
+    parser.add_argument("--failover_timeout", type=float, default=3.0,
+                        help="Seconds without a message from the primary before a standby takes over")
+    return parser.parse_args(argv)
+
+
+def create_server(args, transport=None, clock=None):
+    """Build the server's state and message handlers.
+
+    `transport` sends messages (real sockets by default) and `clock` provides time and timers (wall clock by
+    default), so the same logic can be driven by the simulator.
+    """
 
     server_ip = args.server_ip
     udp_port = args.udp_port
     tcp_port = args.tcp_port
     buffer_size = args.buffer_size
     data_file = args.data_file
+    transport = transport or SocketTransport(buffer_size)
+    clock = clock or RealClock()
+    capture = CaptureWriter(args.capture_file) if args.capture_file else None
+    tracer = Tracer(args.trace_file, args.trace_sample_rate, clock=clock.time)
+    admission = AdmissionController(parse_rate_limits(args.rate_limits), args.max_searches, args.backlog_watermark,
+                                    clock=clock.time)
+    node_id = args.node_id
+    peers = parse_peers(args.peers)
+    ring = HashRing([node_id, *peers]) if peers else None
+    peer_addresses = set(peers.values())  # PEER_* messages are only accepted from these
+    multicast_group = args.multicast_group
+    multicast_port = args.multicast_port
+    own_group = f"{multicast_group}:{multicast_port}" if multicast_group else "-"  # Sent with PEER_SEARCH
 
     all_clients = {}
     active_searches = {}
     reservations = {}
+    remote_clients = {}  # Clients registered on peer nodes that take part in our searches
+    remote_searches = OrderedDict()  # rq -> node that owns the search, for searches started on peer nodes
+    max_remote_searches = 100000
+    multicast_members = set()  # Clients that joined the multicast group and don't need a unicast SEARCH
+    offer_windows = {}  # rq -> time the search started, for searches still waiting for offers
+    offer_windows_lock = threading.Lock()
+    # Held while changing all_clients, active_searches or reservations, and while copying them, so a snapshot never
+    # iterates a dict another thread is changing. Also the replication primary's lock, see replicate().
+    state_lock = threading.RLock()
 
     def load_data():
-        if os.path.exists(data_file):
+        if data_file and os.path.exists(data_file):
             with open(data_file, "r") as file:
                 data = json.load(file)
+            with state_lock:
                 # Load clients
                 for client_name, client_data in data.get("all_clients", {}).items():
                     all_clients[client_name] = Client.from_dict(client_data)
                 # Load active searches
-                global active_searches
-                active_searches = data.get("active_searches", {})
+                active_searches.update(data.get("active_searches", {}))
                 # Load reservations
-                global reservations
-                reservations = data.get("reservations", {})
+                reservations.update(data.get("reservations", {}))
             print("Data loaded from file.")
         else:
             print("No previous data file found. Starting fresh.")
 
+    def snapshot_data():
+        """A copy of the state, safe to serialize while handlers keep changing it."""
+        with state_lock:
+            return {
+                "all_clients": {name: client.to_dict() for name, client in all_clients.items()},
+                "active_searches": copy.deepcopy(active_searches),
+                "reservations": copy.deepcopy(reservations),
+            }
+
     def save_data():
-        data = {
-            "all_clients": {name: client.to_dict() for name, client in all_clients.items()},
-            "active_searches": active_searches,
-            "reservations": reservations,
-        }
+        if not data_file:
+            return
+        data = snapshot_data()  # A copy, so writing it doesn't hold up handlers
         with open(data_file, "w") as file:
             json.dump(data, file, indent=4)
         print("Data saved to file.")
 
+    def replicate(table, key):
+        """Stream the current value of one state entry to standby servers."""
+        if replication_primary:
+            # Read and publish under the state lock, which callers also hold while changing the entry, so updates
+            # reach standbys in the order they were made. Otherwise a stale value could be published after a delete.
+            with state_lock:
+                if table == "all_clients":
+                    value = all_clients[key].to_dict() if key in all_clients else None
+                elif table == "active_searches":
+                    value = active_searches.get(key)
+                else:
+                    value = reservations.get(key)
+                replication_primary.publish(table, key, value)
+
+    def apply_snapshot(data):
+        """Replace the in-memory state with a snapshot streamed by the primary."""
+        with state_lock:
+            all_clients.clear()
+            for client_name, client_data in data["all_clients"].items():
+                all_clients[client_name] = Client.from_dict(client_data)
+            active_searches.clear()
+            active_searches.update(data["active_searches"])
+            reservations.clear()
+            reservations.update(data["reservations"])
+
+    def apply_replicated(table, key, value):
+        """Apply one state change streamed by the primary."""
+        state = {"all_clients": all_clients, "active_searches": active_searches, "reservations": reservations}[table]
+        with state_lock:
+            if value is None:
+                state.pop(key, None)
+            elif table == "all_clients":
+                state[key] = Client.from_dict(value)
+            else:
+                state[key] = value
+
     def log_action(action):
         """Log server actions to a log file."""
-        with open("server.log", "a") as log_file:
+        if not args.log_file:
+            return
+        with open(args.log_file, "a") as log_file:
             log_file.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - {action}\n")
 
-    def broadcast_search(rq, requester_name, item_name, description, max_price):
-        """Send SEARCH message to all clients except the requester."""
-        global udp_socket
+    def send_udp(message, address):
+        """Send a UDP message to a client (and record it when capturing)."""
+        if capture:
+            # Recorded before sending, so a quick reply from the client can't be captured ahead of it
+            capture.record(OUTBOUND, "UDP", address, message)
+        with tracer.message_span("send", message, address):
+            transport.send_udp(message, address)
+
+    def owner_of(client_name):
+        """Name of the node that holds a client's registration."""
+        return ring.node_for(client_name) if ring else node_id
+
+    def from_peer(address):
+        """True if a message came from one of the configured peer nodes."""
+        return tuple(address) in peer_addresses
+
+    def lookup_client(name):
+        """Find a client registered on this node, or one a peer node told us about."""
+        return all_clients.get(name) or remote_clients.get(name)
+
+    def forward_to_node(target_node, rq, message, client_address, client=None):
+        """Hand a client message over to another node, which replies to the client directly."""
+        if client:
+            client_info = f"{client.ip} {client.udp_port} {client.tcp_port}"
+        else:
+            client_info = "- - -"
+        peer_message = f"PEER_FWD {rq} {client_address[0]} {client_address[1]} {client_info} {message}"
+        send_udp(peer_message, peers[target_node])
+        print(f"Forwarded {message.split()[0]} {rq} to {target_node}")
+
+    def route_message(command, rq, parts, message, client_address, forwarded):
+        """Forward a message that belongs to another node. Returns True if it was forwarded."""
+        # Client messages are handled by the node that owns the sending client
+        if not forwarded and not command.startswith("PEER_") and len(parts) > 2:
+            owner = owner_of(parts[2])
+            if owner != node_id:
+                forward_to_node(owner, rq, message, client_address)
+                return True
+
+        # Answers to a search go back to the node that started it
+        if command in ("OFFER", "ACCEPT", "REFUSE") and rq not in active_searches and rq in remote_searches:
+            forward_to_node(remote_searches[rq], rq, message, client_address, all_clients.get(parts[2]))
+            return True
+        return False
+
+    def fan_out_search(rq, requester_name, item_name, description, origin_group=None):
+        """Send SEARCH to every client on this node except the requester. Returns the number of clients.
+
+        Only the node that owns the search multicasts it. For a peer node's search, `origin_group` is the group
+        that node used: members of the same group already got its datagram and are only counted here.
+        """
         num_sellers = 0
+        reached_by_group = set()
+        if multicast_group and origin_group is None:
+            if multicast_members or peers:
+                # One datagram reaches every member. The requester is named so it can ignore its own search.
+                search_message = f"SEARCH {rq} {item_name} {description} {requester_name}"
+                send_udp(search_message, (multicast_group, multicast_port))
+                print(f"Sent SEARCH through multicast group {multicast_group}:{multicast_port}")
+            reached_by_group = multicast_members
+        elif multicast_group and origin_group == own_group:
+            reached_by_group = multicast_members
+            print(f"SEARCH {rq} reached our multicast members through {origin_group}")
+        num_sellers = len(reached_by_group - {requester_name})
+
         for client_key, client in all_clients.items():
-            if client.name != requester_name:
+            if client.name != requester_name and client.name not in reached_by_group:
                 search_message = f"SEARCH {rq} {item_name} {description}"
-                udp_socket.sendto(search_message.encode(), (client.ip, int(client.udp_port)))
+                send_udp(search_message, (client.ip, int(client.udp_port)))
                 print(f"Sent SEARCH to {client.name} at {client.ip}:{client.udp_port}")
                 num_sellers += 1
+        return num_sellers
 
-        active_searches[rq] = {
-            "requester_name": requester_name,
-            "item_name": item_name,
-            "max_price": int(max_price),
-            "offers": [],
-            "expected_offers": num_sellers
-        }
+    @tracer.traced("broadcast_search")
+    def broadcast_search(rq, requester_name, item_name, description, max_price):
+        """Send SEARCH message to all clients except the requester."""
+        num_sellers = fan_out_search(rq, requester_name, item_name, description)
+
+        with state_lock:
+            active_searches[rq] = {
+                "requester_name": requester_name,
+                "item_name": item_name,
+                "max_price": int(max_price),
+                "offers": [],
+                "expected_offers": num_sellers,
+                "pending_nodes": len(peers),
+            }
+            replicate("active_searches", rq)
 
-        threading.Thread(target=check_offers_after_timeout, args=(rq,), daemon=True).start()
+        # Peer nodes fan out to their own clients and report how many offers to expect
+        for peer_address in peers.values():
+            send_udp(f"PEER_SEARCH {rq} {node_id} {requester_name} {item_name} {description} {own_group}",
+                     peer_address)
+
+        open_offer_window(rq)
         log_action(f"SEARCH broadcasted for {item_name} by {requester_name}")
         save_data()
 
-    def check_offers_after_timeout(rq):
-        """Evaluate offers after waiting for 5 minutes or receiving all expected offers."""
-        global udp_socket
-        timeout = 120
-        start_time = time.time()
-
-        while time.time() - start_time < timeout:
-            if rq not in active_searches:
-                return  # The request has already been processed
+    def open_offer_window(rq):
+        """Start waiting for the offers of a search. It is closed by a timer, or earlier once all offers are in."""
+        with offer_windows_lock:
+            if rq in offer_windows:
+                return  # Already waiting for the offers of this rq
+            offer_windows[rq] = clock.time()
+        admission.search_started()
+        if offers_complete(rq):
+            close_offer_window(rq)  # Nothing to wait for, e.g. no other client was sent the search
+        else:
+            clock.call_later(args.offer_timeout, close_offer_window, rq)
 
-            if len(active_searches[rq]["offers"]) >= active_searches[rq]["expected_offers"]:
-                break
+    def offers_complete(rq):
+        search_info = active_searches[rq]
+        return search_info.get("pending_nodes", 0) == 0 and len(search_info["offers"]) >= search_info["expected_offers"]
 
-            time.sleep(1)
+    def close_offer_window(rq):
+        """Evaluate the offers of a search, exactly once per offer window."""
+        with offer_windows_lock:
+            if rq not in offer_windows:
+                return  # Already closed
+            started_at = offer_windows.pop(rq)
+        admission.search_finished()
+        tracer.complete(rq, "offer_window", started_at, clock.time())
 
         if rq in active_searches:
             process_offers(rq)
 
+    @tracer.traced("process_peer_search")
+    def process_peer_search(rq, origin_node, requester_name, item_name, description, origin_group):
+        """Fan out a search started on a peer node and tell it how many offers to expect."""
+        remote_searches[rq] = origin_node
+        while len(remote_searches) > max_remote_searches:
+            remote_searches.popitem(last=False)
+
+        num_sellers = fan_out_search(rq, requester_name, item_name, description, origin_group)
+        send_udp(f"PEER_SEARCH_ACK {rq} {node_id} {num_sellers}", peers[origin_node])
+
+    def process_peer_search_ack(rq, peer_node, num_sellers):
+        """Add the clients a peer node contacted to the offers expected for a search."""
+        if rq in active_searches:
+            search_info = active_searches[rq]
+            with state_lock:
+                search_info["expected_offers"] += int(num_sellers)
+                search_info["pending_nodes"] = max(0, search_info.get("pending_nodes", 0) - 1)
+                replicate("active_searches", rq)
+            if offers_complete(rq):
+                close_offer_window(rq)
+            print(f"{peer_node} sent SEARCH {rq} to {num_sellers} clients")
+
+    @tracer.traced("process_offers")
     def process_offers(rq):
         """Process offers for a request after all responses or timeout."""
-        global udp_socket, reservations
         if rq not in active_searches:
             print(f"ERROR: {rq} already removed from active_searches in process_offers.")
             return
@@ -146,26 +365,29 @@ def start_server():
             seller_name, item_name, price = lowest_offer
 
             # Send RESERVE to seller and FOUND to buyer
-            seller_client = all_clients[seller_name]
+            seller_client = lookup_client(seller_name)
             reserve_message = f"RESERVE {rq} {item_name} {price}"
-            udp_socket.sendto(reserve_message.encode(), (seller_client.ip, int(seller_client.udp_port)))
+            send_udp(reserve_message, (seller_client.ip, int(seller_client.udp_port)))
             print(f"Sent RESERVE to {seller_name} for item {item_name} at price {price}")
 
             # Notify the buyer about the availability
             buyer_client = all_clients[buyer_name]
             found_message = f"FOUND {rq} {item_name} {price}"
-            udp_socket.sendto(found_message.encode(), (buyer_client.ip, int(buyer_client.udp_port)))
+            send_udp(found_message, (buyer_client.ip, int(buyer_client.udp_port)))
             print(f"Sent FOUND to {buyer_name} for item {item_name} at price {price}")
-            # Store the reservation
-            reservations[rq] = {
-                "seller_name": seller_name,
-                "item_name": item_name,
-                "price": price,
-            }
-            # Update the active search status instead of deleting
-            active_searches[rq]["status"] = "RESERVED"
-            active_searches[rq]["reserved_seller"] = seller_name
-            active_searches[rq]["reserved_price"] = price
+            with state_lock:
+                # Store the reservation
+                reservations[rq] = {
+                    "seller_name": seller_name,
+                    "item_name": item_name,
+                    "price": price,
+                }
+                # Update the active search status instead of deleting
+                active_searches[rq]["status"] = "RESERVED"
+                active_searches[rq]["reserved_seller"] = seller_name
+                active_searches[rq]["reserved_price"] = price
+                replicate("reservations", rq)
+                replicate("active_searches", rq)
 
         else:
             # If no valid offers, attempt negotiation
@@ -174,28 +396,37 @@ def start_server():
                 lowest_above_max_offer = min(above_max_offers, key=lambda x: x[2])
                 seller_name, item_name, lowest_price = lowest_above_max_offer
 
-                seller_client = all_clients[seller_name]
+                seller_client = lookup_client(seller_name)
                 negotiate_message = f"NEGOTIATE {rq} {item_name} {max_price}"
-                udp_socket.sendto(negotiate_message.encode(), (seller_client.ip, int(seller_client.udp_port)))
+                send_udp(negotiate_message, (seller_client.ip, int(seller_client.udp_port)))
                 print(f"Sent NEGOTIATE to {seller_name} for item {item_name} at max price {max_price}")
+                with state_lock:
+                    active_searches[rq]["status"] = "NEGOTIATING"
+                    replicate("active_searches", rq)
 
             else:
                 print(f"No valid offers found for {rq}. Cleaning up.")
-                del active_searches[rq]  # Clean up only when no negotiation is possible
+                with state_lock:
+                    del active_searches[rq]  # Clean up only when no negotiation is possible
+                    replicate("active_searches", rq)
 
+    @tracer.traced("process_offer")
     def process_offer(rq, offer_name, item_name, price):
         """Process an OFFER message from a client."""
-        global udp_socket
         if rq in active_searches:
             search_info = active_searches[rq]
-            search_info["offers"].append((offer_name, item_name, int(price)))
+            with state_lock:
+                search_info["offers"].append((offer_name, item_name, int(price)))
+                replicate("active_searches", rq)
+            if offers_complete(rq):
+                close_offer_window(rq)
             print(f"Received OFFER from {offer_name} for {item_name} at price {price}")
         else:
             print(f"ERROR: Request {rq} not found in active_searches during OFFER processing.")
 
+    @tracer.traced("process_accept")
     def process_accept(rq, seller_name, item_name, max_price):
         """Process an ACCEPT message from a seller."""
-        global reservations
         if rq in active_searches:
             search_info = active_searches[rq]
             buyer_name = search_info["requester_name"]
@@ -205,29 +436,32 @@ def start_server():
 
                 # Send FOUND message to the buyer to confirm availability
                 found_message = f"FOUND {rq} {item_name} {max_price}"
-                udp_socket.sendto(found_message.encode(), (buyer_client.ip, int(buyer_client.udp_port)))
+                send_udp(found_message, (buyer_client.ip, int(buyer_client.udp_port)))
                 print(f"Sent FOUND to {buyer_name} for item {item_name} at price {max_price}")
 
                 # Store the reservation
-                reservations[rq] = {
+                reservation = {
                     "seller_name": seller_name,
                     "item_name": item_name,
                     "price": max_price,
                 }
-                print(f"Reservation created for {rq}: {reservations[rq]}")
+                with state_lock:
+                    reservations[rq] = reservation
+                    del active_searches[rq]
+                    replicate("reservations", rq)
+                    replicate("active_searches", rq)
+                print(f"Reservation created for {rq}: {reservation}")
 
                 # Log reservation creation
-                log_action(f"Reservation created: {reservations[rq]}")
-
-                del active_searches[rq]
+                log_action(f"Reservation created: {reservation}")
             else:
                 print(f"ERROR: Buyer {buyer_name} not found in all_clients.")
         else:
             print(f"ERROR: Request {rq} not found in active_searches during ACCEPT.")
 
+    @tracer.traced("process_refuse")
     def process_refuse(rq, seller_name, item_name, max_price):
         """Process a REFUSE message from a seller."""
-        global udp_socket
         if rq in active_searches:
             search_info = active_searches[rq]
             buyer_name = search_info["requester_name"]
@@ -237,18 +471,20 @@ def start_server():
 
                 # Send NOT_FOUND message to the buyer
                 not_found_message = f"NOT_FOUND {rq} {item_name} {max_price}"
-                udp_socket.sendto(not_found_message.encode(), (buyer_client.ip, int(buyer_client.udp_port)))
+                send_udp(not_found_message, (buyer_client.ip, int(buyer_client.udp_port)))
                 print(f"Sent NOT_FOUND to {buyer_name} for item {item_name} at max price {max_price}")
 
-                del active_searches[rq]
+                with state_lock:
+                    del active_searches[rq]
+                    replicate("active_searches", rq)
             else:
                 print(f"ERROR: Buyer {buyer_name} not found in all_clients.")
         else:
             print(f"ERROR: Request {rq} not found in active_searches during REFUSE.")
 
+    @tracer.traced("process_cancel")
     def process_cancel(rq, buyer_name):
         """Process a CANCEL message from a buyer."""
-        global udp_socket
         if rq in active_searches:
             # If the request exists in active_searches, proceed with cancellation
             search_info = active_searches[rq]
@@ -257,12 +493,14 @@ def start_server():
             if seller_name:
                 # Send CANCEL message to the seller
                 cancel_message = f"CANCEL {rq} {search_info['item_name']} {search_info.get('reserved_price', 'N/A')}"
-                seller_client = all_clients[seller_name]
-                udp_socket.sendto(cancel_message.encode(), (seller_client.ip, int(seller_client.udp_port)))
+                seller_client = lookup_client(seller_name)
+                send_udp(cancel_message, (seller_client.ip, int(seller_client.udp_port)))
                 print(f"Sent CANCEL to {seller_name} for item {search_info['item_name']}")
 
             # Remove the reservation from active_searches
-            del active_searches[rq]
+            with state_lock:
+                del active_searches[rq]
+                replicate("active_searches", rq)
             print(f"Request {rq} has been canceled and removed from active_searches.")
         else:
             # If the request doesn't exist in active_searches, log a message but don't raise an error
@@ -271,8 +509,8 @@ def start_server():
     def should_proceed():
         return random.random() < 0.9  # 90% chance to return True
 
+    @tracer.traced("process_buy")
     def process_buy(rq, buyer_name):
-        global reservations
 
         # Log the reservation state before lookup
         log_action(f"Current reservations: {reservations}")
@@ -291,7 +529,7 @@ def start_server():
         price = transaction_info["price"]
 
         buyer = all_clients[buyer_name]
-        seller = all_clients[seller_name]
+        seller = lookup_client(seller_name)
 
         # Prepare TCP connections
         buyer_conn = (buyer.ip, int(buyer.tcp_port))
@@ -333,7 +571,9 @@ def start_server():
                     send_tcp_message(seller_conn, success_message)
 
                     # Remove the reservation
-                    del reservations[rq]
+                    with state_lock:
+                        del reservations[rq]
+                        replicate("reservations", rq)
                 else:
                     # Cancel the transaction and notify parties
                     print(f"Transaction canceled for {item_name}. Random failure triggered.")
@@ -342,7 +582,9 @@ def start_server():
                     send_tcp_message(seller_conn, cancel_message)
 
                     # Remove the reservation
-                    del reservations[rq]
+                    with state_lock:
+                        del reservations[rq]
+                        replicate("reservations", rq)
 
             else:
                 # Handle transaction failure
@@ -360,14 +602,15 @@ def start_server():
     def send_and_receive_tcp(connection, message):
         """Send a message over TCP and wait for a response."""
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as tcp_socket:
-                tcp_socket.settimeout(300)  # Set a timeout
-                tcp_socket.connect(connection)
-                tcp_socket.sendall(message.encode())
+            with tracer.message_span("tcp_round_trip", message, connection):
+                response = transport.request_tcp(connection, message, 300)
                 print(f"Sent message: {message}")
+                if capture:
+                    capture.record(OUTBOUND, "TCP", connection, message)
 
-                response = tcp_socket.recv(1024).decode()  # Receive response
                 print(f"Received response: {response}")
+                if capture:
+                    capture.record(RESPONSE, "TCP", connection, response)
                 return response  # Return the response
         except socket.timeout:
             print(f"Error: TCP connection to {connection} timed out.")
@@ -380,11 +623,11 @@ def start_server():
     def send_tcp_message(connection, message):
         """Send a message over TCP without waiting for a response."""
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as tcp_socket:
-                tcp_socket.settimeout(5)  # Set a timeout of 5 seconds
-                tcp_socket.connect(connection)
-                tcp_socket.sendall(message.encode())
+            with tracer.message_span("tcp_send", message, connection):
+                transport.send_tcp(connection, message, 5)
                 print(f"Sent message: {message}")
+                if capture:
+                    capture.record(OUTBOUND, "TCP", connection, message)
         except socket.timeout:
             print(f"Error: TCP connection to {connection} timed out.")
         except ConnectionRefusedError:
@@ -392,33 +635,62 @@ def start_server():
         except Exception as e:
             print(f"Error sending TCP message: {e}")
 
-    def handle_message(message, client_address, type):
-        global udp_socket
+    def handle_message(message, client_address, type, forwarded=False):
         parts = message.split()
         command = parts[0]
         rq = parts[1]
 
+        if command.startswith("PEER_") and (forwarded or not from_peer(client_address)):
+            print(f"Dropped {command} {rq} from {client_address[0]}:{client_address[1]}, not a peer node")
+            return
+
+        if command == "PEER_FWD":
+            # A client message forwarded by a peer node: reply to the original client address
+            reply_ip, reply_port, client_ip, client_udp_port, client_tcp_port = parts[2:7]
+            original_parts = parts[7:]
+            if client_ip != "-":
+                remote_clients[original_parts[2]] = Client(original_parts[2], client_ip, client_udp_port,
+                                                           client_tcp_port)
+            handle_message(" ".join(original_parts), (reply_ip, int(reply_port)), type, forwarded=True)
+            return
+
+        if peers and route_message(command, rq, parts, message, client_address, forwarded):
+            return
+
+        with tracer.span(rq, f"handle {command}", source=f"{client_address[0]}:{client_address[1]}", transport=type):
+            dispatch_message(command, rq, parts, client_address)
+
+    def dispatch_message(command, rq, parts, client_address):
         if command == "REGISTER":
             name, ip, udp_port, tcp_port = parts[2:]
             if name in all_clients:
                 response = f"REGISTER-DENIED {rq} Name already registered"
             else:
-                all_clients[name] = Client(name, ip, udp_port, tcp_port)
+                with state_lock:
+                    all_clients[name] = Client(name, ip, udp_port, tcp_port)
+                    replicate("all_clients", name)
+                multicast_members.discard(name)
                 response = f"REGISTERED {rq}"
+                if multicast_group:
+                    # Invite the client to join the multicast group used for SEARCH
+                    response += f" {multicast_group} {multicast_port}"
                 log_action(f"Client {name} registered with IP {ip}, UDP Port {udp_port}, TCP Port {tcp_port}")
                 save_data()
-            udp_socket.sendto(response.encode(), client_address)
+            send_udp(response, client_address)
 
         elif command == "DE-REGISTER":
             name = parts[2]
             if name in all_clients:
-                del all_clients[name]
+                with state_lock:
+                    all_clients.pop(name, None)
+                    replicate("all_clients", name)
+                multicast_members.discard(name)
                 response = f"DE-REGISTERED {rq}"
                 log_action(f"Client {name} de-registered")
                 save_data()
             else:
                 response = f"DE-REGISTER-FAILED {rq} Not registered"
-            udp_socket.sendto(response.encode(), client_address)
+            send_udp(response, client_address)
 
         elif command == "LOOKING_FOR":
             requester_name = parts[2]
@@ -431,7 +703,7 @@ def start_server():
                 f"{requester_name} is looking for {item_name} (Description: {description}, Max Price: {max_price})")
             broadcast_search(rq, requester_name, item_name, description, max_price)
             response = f"LOOKING_FOR_ACK {rq} SEARCH request broadcasted"
-            udp_socket.sendto(response.encode(), client_address)
+            send_udp(response, client_address)
 
         elif command == "OFFER":
             offer_name = parts[2]
@@ -469,9 +741,91 @@ def start_server():
             log_action(f"Received REFUSE from {buyer_name}")
             process_buy(rq, buyer_name)
 
+        elif command == "MULTICAST_JOINED":
+            name = parts[2]
+            if multicast_group and name in all_clients:
+                multicast_members.add(name)
+                print(f"{name} joined multicast group {multicast_group}:{multicast_port}")
+                log_action(f"Client {name} joined multicast group {multicast_group}:{multicast_port}")
+
+        elif command == "PEER_SEARCH":
+            origin_node, requester_name, item_name, description = parts[2:6]
+            origin_group = parts[6] if len(parts) > 6 else "-"
+            if origin_node not in peers:
+                print(f"Dropped PEER_SEARCH {rq} from unknown node {origin_node}")
+                return
+            print(f"{origin_node} forwarded search {rq} for {item_name} by {requester_name}")
+            process_peer_search(rq, origin_node, requester_name, item_name, description, origin_group)
+
+        elif command == "PEER_SEARCH_ACK":
+            peer_node, num_sellers = parts[2:4]
+            process_peer_search_ack(rq, peer_node, num_sellers)
+
+    def admit_message(message, client_address):
+        """Apply admission control to a UDP message. Replies BUSY and returns False if it is throttled."""
+        parts = message.split()
+        if parts and parts[0].startswith("PEER_") and not from_peer(client_address):
+            print(f"Dropped {parts[0]} from {client_address[0]}:{client_address[1]}, not a peer node")
+            return False
+        if len(parts) > 7 and parts[0] == "PEER_FWD":
+            # Forwarded client messages are checked by the node that handles them
+            client_address = (parts[2], int(parts[3]))
+            parts = parts[7:]
+        elif parts and parts[0].startswith("PEER_"):
+            # A peer's search fans out to all our clients, so it is shed under load like a LOOKING_FOR.
+            # Peers don't understand BUSY, their search is evaluated with the offers it got in time.
+            admitted, retry_after = admission.admit(parts[0], ("peer", client_address[0], client_address[1]))
+            if not admitted:
+                print(f"Shed {parts[0]} from peer {client_address[0]}:{client_address[1]}")
+            return admitted
+        if len(parts) < 3:
+            return True  # Malformed messages are cheap, let handle_message deal with them
+        command, rq, client_name = parts[:3]
+        if owner_of(client_name) != node_id:
+            return True  # Will be forwarded to, and checked by, the owning node
+
+        # A registered client sending from its registered address is limited by name. Anyone else is limited by
+        # IP, so neither a made-up name nor a new source port gets a fresh bucket.
+        client = all_clients.get(client_name)
+        if client and (client.ip, str(client.udp_port)) == (client_address[0], str(client_address[1])):
+            client_key = ("client", client_name)
+        else:
+            client_key = ("ip", client_address[0])
+        admitted, retry_after = admission.admit(command, client_key)
+        if not admitted:
+            print(f"Throttled {command} {rq} from {client_name} at {client_address[0]}:{client_address[1]}, "
+                  f"retry after {retry_after:.1f}s")
+            # Never advertise 0.0, a client retrying at once would only be throttled again
+            send_udp(f"BUSY {rq} {command} {max(retry_after, 0.1):.1f}", client_address)
+        return admitted
+
+    def run_handler(message, client_address, type):
+        try:
+            handle_message(message, client_address, type)
+        finally:
+            admission.dispatch_finished()
+
+    def receive_udp(message, client_address):
+        """Admit and handle one datagram on the calling thread (used by the simulator)."""
+        if admit_message(message, client_address):
+            admission.dispatch_started()
+            run_handler(message, client_address, "UDP")
+
+    def report_admission_stats():
+        """Periodically log load and throttling counters when they change."""
+        last_summary = None
+        while True:
+            time.sleep(args.stats_interval)
+            summary = admission.summary()
+            if summary != last_summary:
+                print(f"Admission stats: {summary}")
+                log_action(f"Admission stats: {summary}")
+                last_summary = summary
+
     def TCP_listener(port):
         global tcp_socket
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as tcp_socket:
+            tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Allow a standby to take over the port
             tcp_socket.bind((server_ip, port))
             tcp_socket.listen(10)
             print(f"TCP socket started {server_ip}:{port}")
@@ -481,31 +835,87 @@ def start_server():
                 with conn:
                     message = conn.recv(buffer_size)
                     print(f"Received TCP message from {client_address}: {message.decode()}")
+                    if capture:
+                        capture.record(INBOUND, "TCP", client_address, message)
                     threading.Thread(target=handle_message, args=(message.decode(), client_address, 'TCP'),
                                      daemon=True).start()
-                    load_data()
 
     def UDP_listener(port):
-        global udp_socket
         with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp_socket:
             udp_socket.bind((server_ip, port))
+            transport.udp_socket = udp_socket
             print(f"UDP socket started {server_ip}:{port}")
+            if multicast_group:
+                configure_sender(udp_socket, server_ip)
 
             while True:
                 message, client_address = udp_socket.recvfrom(buffer_size)
                 print(f"Received UDP message from {client_address}: {message.decode()}")
+                if capture:
+                    capture.record(INBOUND, "UDP", client_address, message)
 
-                threading.Thread(target=handle_message, args=(message.decode(), client_address, 'UDP'),
+                if not admit_message(message.decode(), client_address):
+                    continue
+
+                admission.dispatch_started()
+                threading.Thread(target=run_handler, args=(message.decode(), client_address, 'UDP'),
                                  daemon=True).start()
 
-    load_data()
-    print(f"Starting server with ip: {server_ip} TCP port: {tcp_port} UDP port: {udp_port} ")
+    def start_listeners():
+        print(f"Starting server with ip: {server_ip} TCP port: {tcp_port} UDP port: {udp_port} ")
+        threading.Thread(target=TCP_listener, args=(tcp_port,), daemon=True).start()
+        threading.Thread(target=UDP_listener, args=(udp_port,), daemon=True).start()
+        threading.Thread(target=report_admission_stats, daemon=True).start()
+
+    def take_over():
+        """Promote this standby: serve the replicated state and resume the offer windows of open searches."""
+        log_action(f"Standby taking over from primary at {args.standby_of}")
+        start_listeners()
+        for rq, search_info in list(active_searches.items()):
+            if "status" not in search_info:
+                open_offer_window(rq)
+        save_data()
+
+    def report_replication_stats():
+        """Periodically log replication lag while running as a standby."""
+        while not replication_standby.failed_over:
+            time.sleep(args.stats_interval)
+            metrics = replication_standby.metrics()
+            print(f"Replication stats: {metrics}")
+            log_action(f"Replication stats: {metrics}")
+
+    replication_primary = None
+    replication_standby = None
+
+    def run():
+        """Start serving (or following a primary as a standby) and block forever."""
+        nonlocal replication_primary, replication_standby
+        if args.standby_of:
+            # Warm standby: keep the state in memory from the primary's stream, don't bind the server ports yet
+            primary_ip, _, primary_port = args.standby_of.rpartition(":")
+            replication_standby = ReplicationStandby((primary_ip, int(primary_port)), apply_snapshot, apply_replicated,
+                                                     take_over, args.failover_timeout)
+            replication_standby.start()
+            threading.Thread(target=report_replication_stats, daemon=True).start()
+        else:
+            load_data()
+            if args.replication_port:
+                replication_primary = ReplicationPrimary(server_ip, args.replication_port, snapshot_data,
+                                                         lock=state_lock)
+                replication_primary.start()
+            start_listeners()
 
-    threading.Thread(target=TCP_listener, args=(tcp_port,), daemon=True).start()
-    threading.Thread(target=UDP_listener, args=(udp_port,), daemon=True).start()
+        while True:
+            pass  # Prevent the main program from exiting
 
-    while True:
-        pass  # Prevent the main program from exiting
+    return SimpleNamespace(handle_message=handle_message, receive_udp=receive_udp, broadcast_search=broadcast_search,
+                           process_offers=process_offers, save_data=save_data, load_data=load_data,
+                           all_clients=all_clients, active_searches=active_searches, reservations=reservations,
+                           offer_windows=offer_windows, admission=admission, run=run)
+
+
+def start_server():
+    create_server(parse_arguments()).run()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,316 @@
+import argparse
+import contextlib
+import heapq
+import itertools
+import os
+import random
+import shlex
+import time
+from collections import Counter
+
+from server import create_server, parse_arguments as parse_server_arguments
+from seller_rules import SellerRules
+from replay import percentile
+
+SERVER_PORT = 5000
+PEER_UDP_PORT = 6000
+PEER_TCP_PORT = 6001
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Run a P2P Shopping marketplace scenario on a virtual clock")
+    parser.add_argument("--peers", type=int, default=200, help="Number of simulated peers (each buys and sells)")
+    parser.add_argument("--nodes", type=int, default=1, help="Number of federated server nodes")
+    parser.add_argument("--duration", type=float, default=600, help="Virtual seconds during which searches start")
+    parser.add_argument("--search_rate", type=float, default=0.005, help="Searches per peer per virtual second")
+    parser.add_argument("--items", type=int, default=50, help="Number of distinct items in the catalog")
+    parser.add_argument("--stock", type=int, default=3, help="Catalog items each peer sells")
+    parser.add_argument("--quantity", type=int, default=5, help="Units of each item a peer sells")
+    parser.add_argument("--latency", type=float, default=0.02, help="One-way datagram latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01, help="Maximum extra random latency in seconds")
+    parser.add_argument("--loss", type=float, default=0.0, help="Fraction of datagrams lost, between 0 and 1")
+    parser.add_argument("--think_time", type=float, default=1.0, help="Mean seconds a peer takes to answer")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for a reproducible run")
+    parser.add_argument("--server_args", type=str, default="",
+                        help='Extra server options, e.g. --server_args="--offer_timeout 30 --max_searches 50"')
+    parser.add_argument("--verbose", action="store_true", help="Show the server's output")
+    return parser.parse_args()
+
+
+class VirtualClock:
+    """Simulated time. Timers run in due-time order when the clock is stepped, without waiting."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.timers = []  # Heap of (due time, sequence, callback, args)
+        self.sequence = itertools.count()  # Timers due at the same time run in the order they were set
+        self.processed = 0
+
+    def time(self):
+        return self.now
+
+    def call_later(self, delay, callback, *args):
+        heapq.heappush(self.timers, (self.now + delay, next(self.sequence), callback, args))
+
+    def run(self, until=float("inf")):
+        """Run every timer due up to `until` (all of them by default), including timers they set."""
+        while self.timers and self.timers[0][0] <= until:
+            due, _, callback, args = heapq.heappop(self.timers)
+            self.now = due
+            callback(*args)
+            self.processed += 1
+        if until != float("inf"):
+            self.now = max(self.now, until)
+
+
+class SimNetwork:
+    """In-memory network. Datagrams arrive after `latency` plus random jitter unless lost; TCP is instant."""
+
+    def __init__(self, clock, latency, jitter, loss, rng):
+        self.clock = clock
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = rng
+        self.udp_endpoints = {}  # address -> handler(message, source address)
+        self.tcp_endpoints = {}  # address -> handler(message) returning the response
+        self.datagrams = 0
+        self.lost = 0
+        self.unroutable = 0
+        self.tcp_requests = 0
+
+    def send_udp(self, source, destination, message):
+        self.datagrams += 1
+        if self.loss and self.rng.random() < self.loss:
+            self.lost += 1
+            return
+        handler = self.udp_endpoints.get(destination)
+        if handler is None:
+            self.unroutable += 1
+            return
+        self.clock.call_later(self.latency + self.rng.random() * self.jitter, handler, message, source)
+
+    def request_tcp(self, destination, message):
+        handler = self.tcp_endpoints.get(destination)
+        if handler is None:
+            raise ConnectionRefusedError(f"Nothing listening on {destination[0]}:{destination[1]}")
+        self.tcp_requests += 1
+        return handler(message)
+
+
+class SimTransport:
+    """Server transport sending through a SimNetwork, counting what it sends per command."""
+
+    def __init__(self, network, address):
+        self.network = network
+        self.address = address
+        self.sent = Counter()
+
+    def send_udp(self, message, address):
+        self.sent[message.split(" ", 1)[0]] += 1
+        self.network.send_udp(self.address, address, message)
+
+    def request_tcp(self, address, message, timeout):
+        self.sent[message.split(" ", 1)[0]] += 1
+        return self.network.request_tcp(address, message)
+
+    def send_tcp(self, address, message, timeout):
+        self.request_tcp(address, message, timeout)
+
+
+class Metrics:
+    def __init__(self):
+        self.registered = 0
+        self.searches = {}  # rq -> virtual time the search was sent
+        self.outcomes = Counter()
+        self.close_times = []
+        self.busy = Counter()
+        self.completed = 0
+        self.canceled = 0
+
+
+class SimPeer:
+    """A peer that searches for random catalog items, buys what it finds and sells its own stock."""
+
+    def __init__(self, index, ip, entry_node, catalog, args, network, metrics, rng):
+        self.name = f"peer{index}"
+        self.index = index
+        self.ip = ip
+        self.address = (ip, PEER_UDP_PORT)
+        self.entry_node = entry_node
+        self.catalog = catalog
+        self.args = args
+        self.network = network
+        self.clock = network.clock
+        self.metrics = metrics
+        self.rng = rng
+        self.rq_counter = itertools.count()
+        self.registered = False
+
+        items = {}
+        for item_name in rng.sample(sorted(catalog), args.stock):
+            base_price = catalog[item_name]
+            items[item_name] = {"list_price": int(base_price * rng.uniform(0.9, 1.3)),
+                                "floor_price": int(base_price * rng.uniform(0.7, 0.9)),
+                                "quantity": args.quantity}
+        self.rules = SellerRules(items, {"cc_number": "4111111111111111", "cc_expiry": "12/27",
+                                         "address": f"{index}_Simulation_Street"})
+        network.udp_endpoints[self.address] = self.handle_udp
+        network.tcp_endpoints[(ip, PEER_TCP_PORT)] = self.handle_tcp
+
+    def generate_rq(self):
+        return f"RQ{self.index}_{next(self.rq_counter)}"
+
+    def send(self, message):
+        self.network.send_udp(self.address, self.entry_node, message)
+
+    def later(self, callback, *args):
+        """Answer after a random think time."""
+        self.clock.call_later(self.rng.expovariate(1 / self.args.think_time), callback, *args)
+
+    def register(self):
+        if self.registered or self.clock.time() > self.args.duration:
+            return
+        self.send(f"REGISTER {self.generate_rq()} {self.name} {self.ip} {PEER_UDP_PORT} {PEER_TCP_PORT}")
+        self.clock.call_later(2.0, self.register)  # Retry until REGISTERED arrives, the datagram may be lost
+
+    def schedule_search(self):
+        delay = self.rng.expovariate(self.args.search_rate)
+        if self.clock.time() + delay <= self.args.duration:
+            self.clock.call_later(delay, self.search)
+
+    def search(self):
+        item_name = self.rng.choice(sorted(self.catalog))
+        max_price = int(self.catalog[item_name] * self.rng.uniform(0.8, 1.2))
+        rq = self.generate_rq()
+        self.metrics.searches[rq] = self.clock.time()
+        self.send(f"LOOKING_FOR {rq} {self.name} {item_name} simulated {max_price}")
+        self.schedule_search()
+
+    def handle_udp(self, message, source):
+        parts = message.split()
+        command, rq = parts[0], parts[1]
+
+        # Names are unique, so a denial means the REGISTERED reply to an earlier attempt was lost
+        if command in ("REGISTERED", "REGISTER-DENIED") and not self.registered:
+            self.registered = True
+            self.metrics.registered += 1
+            self.schedule_search()
+
+        elif command == "SEARCH":
+            price = self.rules.offer_price(parts[2])
+            if price is not None:
+                self.later(self.send, f"OFFER {rq} {self.name} {parts[2]} {price}")
+
+        elif command == "NEGOTIATE":
+            item_name, max_price = parts[2], parts[3]
+            answer = "ACCEPT" if self.rules.accept(rq, item_name, max_price) else "REFUSE"
+            self.later(self.send, f"{answer} {rq} {self.name} {item_name} {max_price}")
+
+        elif command == "RESERVE":
+            self.rules.reserve(rq, parts[2])
+
+        elif command == "CANCEL":
+            self.rules.release(rq)
+
+        elif command in ("FOUND", "NOT_FOUND"):
+            started_at = self.metrics.searches.pop(rq, None)
+            if started_at is None:
+                return  # Duplicate answer
+            self.metrics.outcomes[command] += 1
+            self.metrics.close_times.append(self.clock.time() - started_at)
+            if command == "FOUND":
+                self.later(self.send, f"BUY {rq} {self.name}")
+
+        elif command == "BUSY":
+            self.metrics.busy[parts[2]] += 1
+            if parts[2] == "LOOKING_FOR":
+                self.metrics.searches.pop(rq, None)
+
+    def handle_tcp(self, message):
+        parts = message.split()
+        command, rq = parts[0], parts[1]
+        if command == "INFORM_Req":
+            profile = self.rules.profile
+            return f"INFORM_Res {rq} {self.name} {profile['cc_number']} {profile['cc_expiry']} {profile['address']}"
+        if command == "Shipping_Info":
+            self.rules.sold(rq)
+            self.metrics.completed += 1
+        elif command == "CANCEL":
+            if rq in self.rules.reserved:
+                self.metrics.canceled += 1  # Counted once, on the seller's side
+            self.rules.release(rq)
+        return ""
+
+
+def build_scenario(args):
+    rng = random.Random(args.seed)
+    random.seed(args.seed)  # The server's transaction outcome uses the global generator
+    clock = VirtualClock()
+    network = SimNetwork(clock, args.latency, args.jitter, args.loss, rng)
+    metrics = Metrics()
+
+    node_addresses = {f"node{n + 1}": (f"10.0.0.{n + 1}", SERVER_PORT) for n in range(args.nodes)}
+    servers = {}
+    for node_id, address in node_addresses.items():
+        peers = ",".join(f"{other}={ip}:{port}" for other, (ip, port) in node_addresses.items() if other != node_id)
+        server_args = parse_server_arguments(["--data_file", "", "--log_file", "", "--node_id", node_id,
+                                              "--peers", peers, *shlex.split(args.server_args)])
+        transport = SimTransport(network, address)
+        servers[node_id] = (create_server(server_args, transport, clock), transport)
+        network.udp_endpoints[address] = servers[node_id][0].receive_udp
+
+    catalog = {f"item{i}": rng.randint(20, 200) for i in range(args.items)}
+    simulated_peers = []
+    for index in range(args.peers):
+        ip = f"10.{1 + (index >> 16) % 254}.{(index >> 8) & 255}.{index & 255}"
+        entry_node = node_addresses[rng.choice(sorted(node_addresses))]
+        peer = SimPeer(index, ip, entry_node, catalog, args, network, metrics, rng)
+        clock.call_later(rng.random(), peer.register)
+        simulated_peers.append(peer)
+    return clock, network, servers, metrics
+
+
+def report(args, clock, network, servers, metrics, wall_time):
+    searches_sent = sum(metrics.outcomes.values()) + len(metrics.searches)
+    sent = sum((transport.sent for server, transport in servers.values()), Counter())
+    found = metrics.outcomes["FOUND"]
+
+    print(f"Simulated {args.peers} peers on {args.nodes} node(s): {args.duration:.0f}s of searches, drained at "
+          f"{clock.time():.1f}s of virtual time in {wall_time:.2f}s of wall time "
+          f"({clock.time() / wall_time:.0f}x real time, {clock.processed} events)")
+    print(f"Network: {network.datagrams} datagrams, {network.lost} lost, {network.unroutable} unroutable, "
+          f"{network.tcp_requests} TCP requests (resolved instantly)")
+    print(f"Registered: {metrics.registered}/{args.peers}")
+    print(f"Searches: {searches_sent} sent, {found} FOUND, {metrics.outcomes['NOT_FOUND']} NOT_FOUND, "
+          f"{len(metrics.searches)} without an answer")
+    if searches_sent:
+        server_messages = sum(sent.values()) - sent["REGISTERED"]
+        print(f"Fan-out per search: {sent['SEARCH'] / searches_sent:.1f} SEARCH, "
+              f"{sent['PEER_FWD'] / searches_sent:.1f} PEER_FWD, {server_messages / searches_sent:.1f} server messages")
+    if metrics.close_times:
+        print(f"Search close time: p50 {percentile(metrics.close_times, 0.5):.2f}s  "
+              f"p95 {percentile(metrics.close_times, 0.95):.2f}s  max {max(metrics.close_times):.2f}s")
+    print(f"Reservations: {found} ({found / args.duration:.2f} per virtual second)")
+    print(f"Purchases: {metrics.completed} completed, {metrics.canceled} canceled")
+    if metrics.busy:
+        print(f"Throttled: {dict(metrics.busy)}")
+    for node_id, (server, transport) in servers.items():
+        print(f"{node_id} state: {len(server.all_clients)} clients, {len(server.active_searches)} searches, "
+              f"{len(server.reservations)} reservations, {len(server.offer_windows)} open offer windows")
+
+
+def main():
+    args = parse_arguments()
+    clock, network, servers, metrics = build_scenario(args)
+    start = time.perf_counter()
+    if args.verbose:
+        clock.run()
+    else:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            clock.run()
+    report(args, clock, network, servers, metrics, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import unittest
+
+from admission import AdmissionController, TokenBucket, parse_rate_limits
+from server import create_server, parse_arguments
+from simulator import VirtualClock
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class RecordingTransport:
+    def __init__(self):
+        self.sent = []  # (message, address)
+
+    def send_udp(self, message, address):
+        self.sent.append((message, address))
+
+    def request_tcp(self, address, message, timeout):
+        return ""
+
+    def send_tcp(self, address, message, timeout):
+        pass
+
+    def busy_replies(self):
+        return [message for message, address in self.sent if message.startswith("BUSY")]
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_retry_after(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, burst=3, clock=clock)
+        self.assertEqual([bucket.take() for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(bucket.take(), 0.5)
+
+    def test_refills_at_rate_up_to_burst(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1, burst=2, clock=clock)
+        bucket.take()
+        bucket.take()
+        clock.now = 1.0
+        self.assertEqual(bucket.take(), 0)
+        self.assertGreater(bucket.take(), 0)
+        clock.now = 100.0
+        self.assertEqual([bucket.take() for _ in range(2)], [0, 0])
+        self.assertGreater(bucket.take(), 0)
+
+    def test_parse_rate_limits(self):
+        self.assertEqual(parse_rate_limits("looking_for=0.2:5, BUY=1"), {"LOOKING_FOR": (0.2, 5.0), "BUY": (1.0, 1.0)})
+        self.assertEqual(parse_rate_limits(""), {})
+
+
+class AdmissionControllerTest(unittest.TestCase):
+    def test_rate_limit_per_client(self):
+        admission = AdmissionController({"LOOKING_FOR": (1, 2)}, clock=FakeClock())
+        self.assertTrue(admission.admit("LOOKING_FOR", "a")[0])
+        self.assertTrue(admission.admit("LOOKING_FOR", "a")[0])
+        admitted, retry_after = admission.admit("LOOKING_FOR", "a")
+        self.assertFalse(admitted)
+        self.assertAlmostEqual(retry_after, 1.0)
+        self.assertTrue(admission.admit("LOOKING_FOR", "b")[0])
+        self.assertTrue(admission.admit("OFFER", "a")[0])  # Not rate limited
+
+    def test_buckets_evicted_least_recently_used(self):
+        admission = AdmissionController({"BUY": (0.001, 1)}, clock=FakeClock())
+        admission.max_buckets = 2
+        admission.admit("BUY", "a")
+        admission.admit("BUY", "b")
+        admission.admit("BUY", "a")  # Throttled, and makes "a" the most recently used
+        admission.admit("BUY", "c")  # Evicts "b"
+        self.assertEqual(list(admission.buckets), [("BUY", "a"), ("BUY", "c")])
+        self.assertFalse(admission.admit("BUY", "a")[0])
+
+    def test_search_cap(self):
+        admission = AdmissionController({}, max_searches=2, search_retry_after=5.0)
+        admission.search_started()
+        self.assertTrue(admission.admit("LOOKING_FOR", "a")[0])
+        admission.search_started()
+        self.assertEqual(admission.admit("LOOKING_FOR", "a"), (False, 5.0))
+        self.assertTrue(admission.admit("OFFER", "a")[0])
+        admission.search_finished()
+        self.assertTrue(admission.admit("LOOKING_FOR", "a")[0])
+
+    def test_admitting_does_not_take_a_search_slot(self):
+        admission = AdmissionController({}, max_searches=1)
+        for _ in range(3):
+            self.assertTrue(admission.admit("LOOKING_FOR", "a")[0])
+        self.assertEqual(admission.open_searches, 0)
+
+    def test_shedding_above_backlog_watermark(self):
+        admission = AdmissionController({}, backlog_watermark=2)
+        admission.dispatch_started()
+        self.assertTrue(admission.admit("REGISTER", "a")[0])
+        admission.dispatch_started()
+        for command in ("REGISTER", "LOOKING_FOR", "BUY"):
+            self.assertEqual(admission.admit(command, "a"), (False, 1.0))
+        for command in ("OFFER", "ACCEPT", "REFUSE", "CANCEL"):
+            self.assertTrue(admission.admit(command, "a")[0])
+        admission.dispatch_finished()
+        self.assertTrue(admission.admit("BUY", "a")[0])
+        self.assertIn("BUY/shed=1", admission.summary())
+
+
+class ServerAdmissionTest(unittest.TestCase):
+    def create(self, *options):
+        self.transport = RecordingTransport()
+        self.clock = VirtualClock()
+        args = parse_arguments(["--data_file", "", "--log_file", "", *options])
+        return create_server(args, self.transport, self.clock)
+
+    def register(self, server, name, address):
+        server.receive_udp(f"REGISTER R{name} {name} {address[0]} {address[1]} 7000", address)
+
+    def test_malformed_searches_do_not_hold_slots(self):
+        server = self.create("--max_searches", "3", "--rate_limits", "")
+        address = ("10.0.0.2", 6000)
+        self.register(server, "alice", address)
+        self.register(server, "bob", ("10.0.0.3", 6000))
+        for n in range(3):
+            with self.assertRaises((IndexError, ValueError)):
+                server.receive_udp(f"LOOKING_FOR RQ{n} alice lamp", address)
+        with self.assertRaises(ValueError):
+            server.receive_udp("LOOKING_FOR RQ3 alice lamp red cheap", address)
+        self.assertEqual(server.admission.open_searches, 0)
+
+        server.receive_udp("LOOKING_FOR RQ4 alice lamp red 50", address)
+        self.assertEqual(self.transport.busy_replies(), [])
+        self.assertEqual(server.admission.open_searches, 1)
+        self.clock.run()
+        self.assertEqual(server.admission.open_searches, 0)
+
+    def test_search_without_sellers_frees_its_slot_at_once(self):
+        server = self.create("--max_searches", "1")
+        address = ("10.0.0.2", 6000)
+        self.register(server, "alice", address)
+        for n in range(3):
+            server.receive_udp(f"LOOKING_FOR RQ{n} alice lamp red 50", address)
+        self.assertEqual(self.transport.busy_replies(), [])
+        self.assertEqual((server.admission.open_searches, server.offer_windows, server.active_searches), (0, {}, {}))
+        self.assertEqual(self.clock.time(), 0)
+
+    def test_peer_messages_are_dropped_without_peers(self):
+        server = self.create("--rate_limits", "")
+        for n in range(5):
+            self.register(server, f"peer{n}", (f"10.0.0.{n + 2}", 6000))
+        self.transport.sent.clear()
+        for n in range(20):
+            server.receive_udp(f"PEER_SEARCH Z{n} nodeZ mallory lamp red -", ("203.0.113.9", 5000))
+        server.receive_udp("PEER_FWD Y1 203.0.113.9 53 - - - REGISTER Y1 evil 203.0.113.9 6000 6001",
+                           ("203.0.113.9", 5000))
+        self.assertEqual(self.transport.sent, [])
+        self.assertNotIn("evil", server.all_clients)
+
+    def test_rotating_ports_from_one_ip_is_throttled(self):
+        server = self.create("--rate_limits", "LOOKING_FOR=0.2:5")
+        self.register(server, "alice", ("10.0.0.2", 6000))
+        for n in range(20):
+            server.receive_udp(f"LOOKING_FOR RQ{n} alice lamp red 50", ("10.0.0.0", 7000 + n))
+        self.assertEqual(len(self.transport.busy_replies()), 15)
+
+    def test_registered_clients_sharing_an_ip_have_their_own_buckets(self):
+        server = self.create("--rate_limits", "LOOKING_FOR=0.2:5")
+        for name, port in (("alice", 6000), ("bob", 6100)):
+            self.register(server, name, ("10.0.0.2", port))
+            for n in range(5):
+                server.receive_udp(f"LOOKING_FOR {name}{n} {name} lamp red 50", ("10.0.0.2", port))
+        self.assertEqual(self.transport.busy_replies(), [])
+        # Using alice's name from another port of the same IP draws on the IP's bucket, not alice's
+        for n in range(6):
+            server.receive_udp(f"LOOKING_FOR mallory{n} alice lamp red 50", ("10.0.0.2", 7000))
+        self.assertEqual(len(self.transport.busy_replies()), 1)
+
+    def test_peer_search_is_shed_under_load(self):
+        server = self.create("--backlog_watermark", "1", "--peers", "node2=10.0.1.1:5000")
+        self.register(server, "alice", ("10.0.0.2", 6000))
+        self.transport.sent.clear()
+        server.admission.dispatch_started()
+        server.receive_udp("PEER_SEARCH Z1 node2 carol lamp red -", ("10.0.1.1", 5000))
+        self.assertEqual(self.transport.sent, [])
+        server.admission.dispatch_finished()
+        server.receive_udp("PEER_SEARCH Z2 node2 carol lamp red -", ("10.0.1.1", 5000))
+        self.assertEqual(self.transport.sent[-1], ("PEER_SEARCH_ACK Z2 node1 1", ("10.0.1.1", 5000)))
+
+    def test_busy_never_advertises_zero_retry_after(self):
+        server = self.create("--rate_limits", "LOOKING_FOR=20:1")
+        address = ("10.0.0.2", 6000)
+        self.register(server, "alice", address)
+        for n in range(2):
+            server.receive_udp(f"LOOKING_FOR RQ{n} alice lamp red 50", address)
+        self.assertEqual(self.transport.busy_replies(), ["BUSY RQ1 LOOKING_FOR 0.1"])
+
+    def test_rotating_names_from_one_address_is_throttled(self):
+        server = self.create("--rate_limits", "LOOKING_FOR=0.2:5")
+        address = ("10.0.0.2", 6000)
+        for n in range(20):
+            server.receive_udp(f"LOOKING_FOR RQ{n} name{n} lamp red 50", address)
+        self.assertEqual(len(self.transport.busy_replies()), 15)
+
+
+if __name__ == "__main__":
+    unittest.main()
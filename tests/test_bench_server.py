@@ -0,0 +1,40 @@
+import unittest
+
+from bench_server import compare
+
+
+def result(ops_per_sec, peak_bytes):
+    return {"ops_per_sec": ops_per_sec, "peak_bytes": peak_bytes}
+
+
+class CompareTest(unittest.TestCase):
+    def test_throughput_margin(self):
+        baseline = {"process_offers/10": result(1000, 0)}
+        self.assertEqual(compare({"process_offers/10": result(751, 0)}, baseline, 0.25), [])
+        self.assertEqual(compare({"process_offers/10": result(2000, 0)}, baseline, 0.25), [])
+        self.assertEqual(compare({"process_offers/10": result(749, 0)}, baseline, 0.25),
+                         ["process_offers/10: 749.0 ops/s, baseline 1000.0"])
+
+    def test_peak_bytes_margin_with_slack(self):
+        baseline = {"save_data/1000": result(100, 100 * 1024)}
+        # 25% over the baseline plus 16 KiB is allowed, for tracemalloc's own bookkeeping
+        self.assertEqual(compare({"save_data/1000": result(100, 141 * 1024)}, baseline, 0.25), [])
+        self.assertEqual(compare({"save_data/1000": result(100, 142 * 1024)}, baseline, 0.25),
+                         ["save_data/1000: peak 142.0KiB, baseline 100.0KiB"])
+        # Small sizes only get the slack: 0 bytes before, 16 KiB after is not a regression
+        self.assertEqual(compare({"load_data/10": result(100, 16 * 1024)}, {"load_data/10": result(100, 0)}, 0.25),
+                         [])
+
+    def test_both_regressions_are_reported(self):
+        regressions = compare({"broadcast_search/10": result(10, 10 ** 6)},
+                              {"broadcast_search/10": result(100, 1000)}, 0.25)
+        self.assertEqual(len(regressions), 2)
+
+    def test_keys_missing_from_the_baseline_are_skipped(self):
+        results = {"handle_message/10": result(1, 10 ** 9), "handle_message/100": result(100, 0)}
+        self.assertEqual(compare(results, {"handle_message/100": result(100, 0)}, 0.25), [])
+        self.assertEqual(compare(results, {}, 0.25), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
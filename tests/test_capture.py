@@ -0,0 +1,63 @@
+import os
+import tempfile
+import unittest
+
+from capture import INBOUND, OUTBOUND, RECORD_HEADER, RESPONSE, CaptureWriter, read_trace
+
+
+class CaptureTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.path = os.path.join(self.temp_dir.name, "trace.bin")
+
+    def write(self, records):
+        writer = CaptureWriter(self.path)
+        for record in records:
+            writer.record(*record)
+        writer.close()
+
+    def test_round_trip(self):
+        self.write([
+            (INBOUND, "UDP", ("10.0.0.2", 6000), "REGISTER RQ1 alice 10.0.0.2 6000 6001"),
+            (OUTBOUND, "TCP", ("10.0.0.3", "6001"), "INFORM_Req RQ2 lamp 40"),
+            (RESPONSE, "TCP", ("10.0.0.3", 6001), b"INFORM_Res RQ2 bob 4111111111111111 12/27 home"),
+            (INBOUND, "UDP", ("10.0.0.2", 6000), "LOOKING_FOR RQ3 alice café red 50"),
+        ])
+        records = read_trace(self.path)
+        self.assertEqual([(record.direction, record.transport, record.address(), record.message())
+                          for record in records], [
+            (INBOUND, "UDP", ("10.0.0.2", 6000), "REGISTER RQ1 alice 10.0.0.2 6000 6001"),
+            (OUTBOUND, "TCP", ("10.0.0.3", 6001), "INFORM_Req RQ2 lamp 40"),
+            (RESPONSE, "TCP", ("10.0.0.3", 6001), "INFORM_Res RQ2 bob 4111111111111111 12/27 home"),
+            (INBOUND, "UDP", ("10.0.0.2", 6000), "LOOKING_FOR RQ3 alice café red 50"),
+        ])
+        timestamps = [record.timestamp for record in records]
+        self.assertEqual(timestamps, sorted(timestamps))
+
+    def test_non_ipv4_address_is_recorded_as_unspecified(self):
+        self.write([(INBOUND, "UDP", ("::1", 6000), "REGISTER RQ1 alice ::1 6000 6001")])
+        [record] = read_trace(self.path)
+        self.assertEqual((record.address(), record.message()), (("0.0.0.0", 6000), "REGISTER RQ1 alice ::1 6000 6001"))
+
+    def test_truncated_trailing_record_is_ignored(self):
+        self.write([(INBOUND, "UDP", ("10.0.0.2", 6000), "REGISTER RQ1 alice 10.0.0.2 6000 6001"),
+                    (INBOUND, "UDP", ("10.0.0.2", 6000), "LOOKING_FOR RQ2 alice lamp red 50")])
+        size = os.path.getsize(self.path)
+        for cut in (3, len("LOOKING_FOR RQ2 alice lamp red 50") + 2):  # Inside the payload, inside the header
+            with open(self.path, "r+b") as file:
+                file.truncate(size - cut)
+            self.assertEqual([record.message() for record in read_trace(self.path)],
+                             ["REGISTER RQ1 alice 10.0.0.2 6000 6001"])
+
+    def test_empty_and_foreign_files(self):
+        self.write([])
+        self.assertEqual(read_trace(self.path), [])
+        with open(self.path, "wb") as file:
+            file.write(b"not a trace" + bytes(RECORD_HEADER.size))
+        with self.assertRaises(ValueError):
+            read_trace(self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+import random
+import unittest
+from unittest import mock
+
+from federation import HashRing
+from server import create_server, parse_arguments
+from simulator import SimNetwork, SimTransport, VirtualClock
+
+NODES = {"node1": ("10.0.0.1", 5000), "node2": ("10.0.0.2", 5000), "node3": ("10.0.0.3", 5000)}
+
+
+def name_owned_by(node_id, prefix):
+    """First client name the federation's hash ring assigns to `node_id`."""
+    ring = HashRing(list(NODES))
+    return next(f"{prefix}{i}" for i in range(1000) if ring.node_for(f"{prefix}{i}") == node_id)
+
+
+class Peer:
+    """A client endpoint on the simulated network that records what it receives."""
+
+    def __init__(self, network, name, ip):
+        self.network = network
+        self.name = name
+        self.address = (ip, 6000)
+        self.udp_messages = []
+        self.tcp_messages = []
+        network.udp_endpoints[self.address] = self.receive_udp
+        network.tcp_endpoints[(ip, 6001)] = self.receive_tcp
+
+    def send(self, node_id, message):
+        self.network.send_udp(self.address, NODES[node_id], message)
+
+    def register(self, node_id):
+        self.send(node_id, f"REGISTER R{self.name} {self.name} {self.address[0]} 6000 6001")
+
+    def receive_udp(self, message, source):
+        self.udp_messages.append((message, source))
+
+    def receive_tcp(self, message):
+        self.tcp_messages.append(message)
+        rq = message.split()[1]
+        return f"INFORM_Res {rq} {self.name} 4111111111111111 12/27 {self.name}_address"
+
+    def received(self, command):
+        return [message for message, source in self.udp_messages if message.startswith(command + " ")]
+
+
+class FederationTest(unittest.TestCase):
+    def setUp(self):
+        self.create_nodes()
+
+    def create_nodes(self, groups=None):
+        """Start the three nodes. `groups` optionally gives each node a --multicast_group (port 5100)."""
+        self.clock = VirtualClock()
+        self.network = SimNetwork(self.clock, latency=0.001, jitter=0, loss=0, rng=random.Random(0))
+        self.nodes = {}
+        for node_id, address in NODES.items():
+            peers = ",".join(f"{other}={ip}:{port}" for other, (ip, port) in NODES.items() if other != node_id)
+            options = ["--data_file", "", "--log_file", "", "--node_id", node_id, "--peers", peers,
+                       "--offer_timeout", "60"]
+            if groups:
+                options += ["--multicast_group", groups[node_id]]
+            self.nodes[node_id] = create_server(parse_arguments(options), SimTransport(self.network, address),
+                                                self.clock)
+            self.network.udp_endpoints[address] = self.nodes[node_id].receive_udp
+
+        self.buyer = Peer(self.network, name_owned_by("node1", "buyer"), "10.1.0.1")
+        self.seller = Peer(self.network, name_owned_by("node2", "seller"), "10.1.0.2")
+        self.other_seller = Peer(self.network, name_owned_by("node3", "carol"), "10.1.0.3")
+
+    def test_register_is_forwarded_to_owning_node(self):
+        self.buyer.register("node2")
+        self.clock.run()
+        self.assertEqual(self.buyer.udp_messages, [(f"REGISTERED R{self.buyer.name}", NODES["node1"])])
+        self.assertIn(self.buyer.name, self.nodes["node1"].all_clients)
+        self.assertNotIn(self.buyer.name, self.nodes["node2"].all_clients)
+
+    def test_search_offer_reserve_and_buy_across_nodes(self):
+        self.buyer.register("node1")
+        self.seller.register("node1")  # Forwarded to node2
+        self.other_seller.register("node3")
+        self.clock.run()
+
+        self.buyer.send("node1", f"LOOKING_FOR RQ1 {self.buyer.name} lamp red 50")
+        self.clock.run(self.clock.time() + 1)
+        search = self.nodes["node1"].active_searches["RQ1"]
+        self.assertEqual((search["expected_offers"], search["pending_nodes"]), (2, 0))
+        self.assertEqual(self.seller.received("SEARCH"), ["SEARCH RQ1 lamp red"])
+        self.assertEqual(self.other_seller.received("SEARCH"), ["SEARCH RQ1 lamp red"])
+
+        # Each seller answers its own node, which routes the OFFER back to node1
+        self.seller.send("node2", f"OFFER RQ1 {self.seller.name} lamp 40")
+        self.other_seller.send("node3", f"OFFER RQ1 {self.other_seller.name} lamp 45")
+        self.clock.run(self.clock.time() + 1)
+        self.assertEqual(self.nodes["node1"].offer_windows, {})  # Closed as soon as both offers were in
+        self.assertEqual(self.seller.received("RESERVE"), ["RESERVE RQ1 lamp 40"])
+        self.assertEqual(self.buyer.received("FOUND"), ["FOUND RQ1 lamp 40"])
+        self.assertEqual(self.other_seller.received("RESERVE"), [])
+        self.assertEqual(self.nodes["node1"].reservations["RQ1"]["seller_name"], self.seller.name)
+
+        with mock.patch("random.random", return_value=0.0):  # The server cancels 10% of transactions at random
+            self.buyer.send("node1", f"BUY RQ1 {self.buyer.name}")
+            self.clock.run()
+        self.assertEqual(self.buyer.tcp_messages, ["INFORM_Req RQ1 lamp 40"])
+        self.assertEqual(self.seller.tcp_messages,
+                         ["INFORM_Req RQ1 lamp 40", f"Shipping_Info RQ1 {self.buyer.name} {self.buyer.name}_address"])
+        self.assertNotIn("RQ1", self.nodes["node1"].reservations)
+
+    def test_peer_messages_from_other_addresses_are_dropped(self):
+        self.seller.register("node2")
+        self.clock.run()
+        spoofer = Peer(self.network, "mallory", "203.0.113.9")
+        spoofer.send("node2", "PEER_SEARCH Z1 node1 mallory lamp red -")
+        spoofer.send("node2", "PEER_SEARCH Z2 nodeZ mallory lamp red -")
+        spoofer.send("node2", "PEER_FWD Y1 203.0.113.9 53 - - - REGISTER Y1 evil 203.0.113.9 6000 6001")
+        self.clock.run()
+        self.nodes["node2"].handle_message("PEER_SEARCH Z3 node1 mallory lamp red -", spoofer.address, "TCP")
+        self.assertEqual(self.seller.received("SEARCH"), [])
+        self.assertEqual(spoofer.udp_messages, [])
+        self.assertNotIn("evil", self.nodes["node2"].all_clients)
+
+    def test_peer_search_from_unknown_node_is_dropped(self):
+        self.seller.register("node2")
+        self.clock.run()
+        self.network.send_udp(NODES["node1"], NODES["node2"], "PEER_SEARCH Z1 nodeZ someone lamp red -")
+        self.clock.run()
+        self.assertEqual(self.seller.received("SEARCH"), [])
+
+    def join_group(self, group, members):
+        """Deliver datagrams sent to `group` to every member, like a multicast group on a LAN."""
+        def deliver(message, source):
+            for member in members.values():
+                member.receive_udp(message, source)
+
+        self.network.udp_endpoints[(group, 5100)] = deliver
+        for node_id, member in members.items():
+            member.send(node_id, f"MULTICAST_JOINED RJ{member.name} {member.name}")
+
+    def check_search_reaches_each_seller_once(self, groups, group_members):
+        self.create_nodes(groups)
+        self.buyer.register("node1")
+        self.seller.register("node2")
+        self.other_seller.register("node3")
+        self.clock.run()
+        for group, members in group_members.items():
+            self.join_group(group, {node_id: getattr(self, name) for node_id, name in members.items()})
+        self.clock.run()
+
+        self.buyer.send("node1", f"LOOKING_FOR RQ1 {self.buyer.name} lamp red 50")
+        self.clock.run(self.clock.time() + 1)
+        self.assertEqual(len(self.seller.received("SEARCH")), 1)
+        self.assertEqual(len(self.other_seller.received("SEARCH")), 1)
+        self.assertEqual(self.nodes["node1"].active_searches["RQ1"]["expected_offers"], 2)
+
+    def test_shared_multicast_group_is_only_used_by_search_owner(self):
+        group = "239.255.36.6"
+        self.check_search_reaches_each_seller_once({node_id: group for node_id in NODES},
+                                                   {group: {"node1": "buyer", "node2": "seller"}})
+
+    def test_multicast_group_per_node(self):
+        groups = {"node1": "239.255.36.1", "node2": "239.255.36.2", "node3": "239.255.36.3"}
+        self.check_search_reaches_each_seller_once(groups, {"239.255.36.1": {"node1": "buyer"},
+                                                            "239.255.36.2": {"node2": "seller"}})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import asyncio
+import contextlib
+import io
+import unittest
+
+from p2p_client import AsyncClient, ServerBusy
+from server import create_server, parse_arguments
+from transport import RealClock
+
+
+class LoopbackServer(asyncio.DatagramProtocol):
+    """The server's handlers on a loopback UDP socket in the test's event loop. Also the server's transport."""
+
+    def __init__(self, loop, *options):
+        self.loop = loop
+        args = parse_arguments(["--data_file", "", "--log_file", "", "--offer_timeout", "60", *options])
+        self.server = create_server(args, self, RealClock())
+
+    def connection_made(self, transport):
+        self.udp_transport = transport
+
+    def datagram_received(self, data, addr):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.server.receive_udp(data.decode(), addr)
+
+    def send_udp(self, message, address):
+        self.loop.call_soon_threadsafe(self.udp_transport.sendto, message.encode(), address)
+
+    def request_tcp(self, address, message, timeout):
+        return ""
+
+    def send_tcp(self, address, message, timeout):
+        pass
+
+
+def price_for(rq):
+    return 10 + int(rq[2:]) % 37
+
+
+async def answer_searches(seller):
+    """Offer every item searched for, at a price that depends on the rq."""
+    while True:
+        parts = await seller.events.get()
+        if parts[0] == "SEARCH":
+            await seller.offer(parts[1], parts[2], price_for(parts[1]))
+
+
+class AsyncClientServerTest(unittest.IsolatedAsyncioTestCase):
+    async def start(self, *options, busy_retries=10, max_pending=50):
+        loop = asyncio.get_running_loop()
+        transport, self.server = await loop.create_datagram_endpoint(lambda: LoopbackServer(loop, *options),
+                                                                     local_addr=("127.0.0.1", 0))
+        self.addCleanup(transport.close)
+        port = transport.get_extra_info("sockname")[1]
+        # Fewer calls in flight than the 200 below, so bursts don't overflow the loopback sockets' receive buffers
+        buyer = AsyncClient("127.0.0.1", port, max_pending=max_pending, busy_retries=busy_retries)
+        seller = AsyncClient("127.0.0.1", port)
+        for client, name in ((buyer, "alice"), (seller, "bob")):
+            await client.start()
+            self.addAsyncCleanup(client.close)
+            await client.register(name)
+        seller_task = asyncio.create_task(answer_searches(seller))
+        self.addCleanup(seller_task.cancel)
+        return buyer
+
+    async def test_concurrent_searches_get_their_own_results(self):
+        buyer = await self.start("--rate_limits", "")
+        results = await asyncio.gather(*(buyer.search("lamp", "red", 100, timeout=10) for _ in range(200)))
+        self.assertEqual(len({result.rq for result in results}), 200)
+        for result in results:
+            self.assertEqual((result.status, result.price), ("FOUND", str(price_for(result.rq))))
+        self.assertEqual(buyer.pending, {})
+
+    async def test_busy_searches_are_retried(self):
+        buyer = await self.start("--rate_limits", "LOOKING_FOR=5:2")
+        results = await asyncio.gather(*(buyer.search("lamp", "red", 100, timeout=10) for _ in range(6)))
+        self.assertEqual([result.status for result in results], ["FOUND"] * 6)
+        self.assertGreater(self.server.server.admission.summary().count("rate_limit"), 0)
+        self.assertEqual(buyer.pending, {})
+
+    async def test_busy_is_raised_without_retries(self):
+        buyer = await self.start("--rate_limits", "LOOKING_FOR=0.001:2", busy_retries=0)
+        results = await asyncio.gather(*(buyer.search("lamp", "red", 100, timeout=10) for _ in range(5)),
+                                       return_exceptions=True)
+        self.assertEqual(sum(isinstance(result, ServerBusy) for result in results), 3)
+        self.assertEqual(sum(getattr(result, "status", None) == "FOUND" for result in results), 2)
+        self.assertEqual(buyer.pending, {})
+
+
+class AsyncClientReplyTest(unittest.IsolatedAsyncioTestCase):
+    """Replies fed straight into the client, in orders a real network can produce."""
+
+    def setUp(self):
+        self.client = AsyncClient("127.0.0.1", reply_timeout=0.2, busy_retries=0)
+        self.client.name = "alice"
+        self.sent = []
+        self.client.send = self.sent.append
+
+    async def sent_rq(self, count=1):
+        """The rqs of the first `count` messages sent, once they were sent."""
+        while len(self.sent) < count:
+            await asyncio.sleep(0)
+        return [message.split()[1] for message in self.sent[:count]]
+
+    async def test_found_before_looking_for_ack(self):
+        search = asyncio.create_task(self.client.search("lamp", "red", 50))
+        [rq] = await self.sent_rq()
+        self.client.handle_message(f"FOUND {rq} lamp 40")
+        self.client.handle_message(f"LOOKING_FOR_ACK {rq} SEARCH request broadcasted")
+        self.assertEqual(await search, (rq, "FOUND", "lamp", "40"))
+        self.assertEqual(self.client.pending, {})
+
+    async def test_timeouts_empty_pending(self):
+        searches = [asyncio.create_task(self.client.search("lamp", "red", 50, timeout=0.1)) for _ in range(50)]
+        rqs = await self.sent_rq(50)
+        for rq in rqs[:25]:  # Half are acknowledged, then get no result
+            self.client.handle_message(f"LOOKING_FOR_ACK {rq} SEARCH request broadcasted")
+        self.assertEqual({result.status for result in await asyncio.gather(*searches)}, {"TIMEOUT"})
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.client.request("DE-REGISTER", ["alice"])
+        self.assertEqual(self.client.pending, {})
+
+    async def test_busy_reaches_the_throttled_call_only(self):
+        first = asyncio.create_task(self.client.search("lamp", "red", 50))
+        second = asyncio.create_task(self.client.search("lamp", "red", 50))
+        first_rq, second_rq = await self.sent_rq(2)
+        self.client.handle_message(f"BUSY {second_rq} LOOKING_FOR 5.0")
+        self.client.handle_message(f"LOOKING_FOR_ACK {first_rq} SEARCH request broadcasted")
+        self.client.handle_message(f"FOUND {first_rq} lamp 40")
+        with self.assertRaises(ServerBusy) as busy:
+            await second
+        self.assertEqual((busy.exception.command, busy.exception.retry_after), ("LOOKING_FOR", 5.0))
+        self.assertEqual((await first).status, "FOUND")
+
+        buy = asyncio.create_task(self.client.buy(first_rq, "lamp", 40))
+        await self.sent_rq(3)
+        self.client.handle_message(f"BUSY {first_rq} BUY 2.0")  # Answers the BUY, which waits for INFORM_Req
+        with self.assertRaises(ServerBusy):
+            await buy
+        self.assertEqual(self.client.pending, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+import json
+import queue
+import socket
+import threading
+import time
+import unittest
+
+from replication import ReplicationPrimary, ReplicationStandby
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class Replica:
+    """Standby side state, applied the way the server applies a snapshot and ops."""
+
+    def __init__(self):
+        self.state = {}
+        self.applied = []
+
+    def apply_snapshot(self, data):
+        self.applied.append(("snapshot", data))
+        self.state = {table: dict(entries) for table, entries in data.items()}
+
+    def apply_op(self, table, key, value):
+        self.applied.append(("op", table, key, value))
+        if value is None:
+            self.state[table].pop(key, None)
+        else:
+            self.state[table][key] = value
+
+
+class ReplicationStandbyTest(unittest.TestCase):
+    def create(self, failover_timeout=0.2):
+        self.replica = Replica()
+        self.failover = threading.Event()
+        return ReplicationStandby(("127.0.0.1", 1), self.replica.apply_snapshot, self.replica.apply_op,
+                                  self.failover.set, failover_timeout)
+
+    def test_snapshot_then_op_then_delete(self):
+        standby = self.create()
+        standby.apply({"type": "heartbeat", "seq": 1, "ts": time.time()})
+        self.assertFalse(standby.synced)
+
+        standby.apply({"type": "snapshot", "state": {"reservations": {"RQ1": {"price": 40}}}, "seq": 2,
+                       "ts": time.time()})
+        self.assertTrue(standby.synced)
+        standby.apply({"type": "op", "table": "reservations", "key": "RQ2", "value": {"price": 50}, "seq": 3,
+                       "ts": time.time()})
+        standby.apply({"type": "op", "table": "reservations", "key": "RQ1", "value": None, "seq": 4,
+                       "ts": time.time()})
+
+        self.assertEqual(self.replica.state, {"reservations": {"RQ2": {"price": 50}}})
+        self.assertEqual([entry[0] for entry in self.replica.applied], ["snapshot", "op", "op"])
+        self.assertEqual(standby.last_seq, 4)
+        self.assertGreaterEqual(standby.metrics()["lag_ms"], 0)
+
+    def test_fails_over_once_the_primary_goes_quiet(self):
+        standby = self.create(failover_timeout=0.2)
+        threading.Thread(target=standby.watch_primary, daemon=True).start()
+        standby.apply({"type": "snapshot", "state": {}, "seq": 1, "ts": time.time()})
+        for seq in range(2, 8):  # Heartbeats keep it from taking over
+            time.sleep(0.05)
+            standby.apply({"type": "heartbeat", "seq": seq, "ts": time.time()})
+        self.assertFalse(self.failover.is_set())
+
+        self.assertTrue(self.failover.wait(2))
+        self.assertTrue(standby.failed_over)
+
+    def test_never_fails_over_before_the_first_snapshot(self):
+        standby = self.create(failover_timeout=0.1)
+        threading.Thread(target=standby.watch_primary, daemon=True).start()
+        self.assertFalse(self.failover.wait(0.5))
+
+
+class ReplicationPrimaryTest(unittest.TestCase):
+    def test_concurrent_publishes_are_queued_in_seq_order(self):
+        primary = ReplicationPrimary("127.0.0.1", 0, dict)
+        outgoing = queue.Queue()
+        primary.standbys.append(outgoing)
+
+        def publish_many(worker):
+            for n in range(200):
+                primary.publish("active_searches", f"RQ{worker}-{n}", {"n": n})
+
+        workers = [threading.Thread(target=publish_many, args=(worker,)) for worker in range(8)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        seqs = [json.loads(outgoing.get_nowait())["seq"] for _ in range(outgoing.qsize())]
+        self.assertEqual(seqs, list(range(1, 1601)))
+
+    def test_failed_snapshot_only_drops_that_standby(self):
+        calls = []
+
+        def snapshot():
+            calls.append(1)
+            if len(calls) == 1:
+                raise RuntimeError("dictionary changed size during iteration")
+            return {"reservations": {}}
+
+        primary = ReplicationPrimary("127.0.0.1", 0, snapshot)
+        first, first_peer = socket.socketpair()
+        primary.add_standby(first, "first")
+        self.assertEqual(first_peer.recv(1024), b"")  # Closed
+        self.assertEqual(primary.standbys, [])
+
+        second, second_peer = socket.socketpair()
+        primary.add_standby(second, "second")
+        with second_peer.makefile("r") as stream:
+            self.assertEqual(json.loads(stream.readline())["type"], "snapshot")
+        first_peer.close()
+        second_peer.close()
+
+    def test_standby_converges_while_the_primary_changes_state(self):
+        state = {"reservations": {f"RQ{n}": {"price": n} for n in range(50)}}
+        lock = threading.RLock()
+
+        def snapshot():
+            with lock:
+                return {table: dict(entries) for table, entries in state.items()}
+
+        port = free_port()
+        primary = ReplicationPrimary("127.0.0.1", port, snapshot, heartbeat_interval=0.05, lock=lock)
+        primary.start()
+        replica = Replica()
+        standby = ReplicationStandby(("127.0.0.1", port), replica.apply_snapshot, replica.apply_op, lambda: None,
+                                     failover_timeout=30)
+        threading.Thread(target=standby.follow, daemon=True).start()
+        self.assertTrue(wait_until(lambda: standby.synced))
+
+        def change(worker):
+            for n in range(300):
+                key = f"RQ{(worker * 7 + n) % 80}"
+                with lock:  # Change and publish under one lock, like the server's replicate()
+                    if n % 3 == 0:
+                        state["reservations"].pop(key, None)
+                        value = None
+                    else:
+                        value = state["reservations"][key] = {"price": n, "worker": worker}
+                    primary.publish("reservations", key, value)
+
+        workers = [threading.Thread(target=change, args=(worker,)) for worker in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        with lock:
+            last_seq = primary.seq
+        self.assertTrue(wait_until(lambda: standby.last_seq >= last_seq))
+        self.assertEqual(replica.state, state)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+from seller_rules import SellerRules
+
+
+def lamp_rules(quantity=1):
+    return SellerRules({"Lamp": {"list_price": 45, "floor_price": 30, "quantity": quantity}}, {})
+
+
+class SellerRulesTest(unittest.TestCase):
+    def test_accepted_negotiation_holds_a_unit_until_sold(self):
+        rules = lamp_rules()
+        self.assertTrue(rules.accept("RQ1", "lamp", "35"))
+        self.assertIsNone(rules.offer_price("lamp"))
+        rules.sold("RQ1")
+        self.assertEqual(rules.items["lamp"]["quantity"], 0)
+
+    def test_negotiation_refused_below_floor_or_without_stock(self):
+        rules = lamp_rules()
+        self.assertFalse(rules.accept("RQ1", "lamp", "29"))
+        self.assertTrue(rules.reserve("RQ2", "lamp"))
+        self.assertFalse(rules.accept("RQ3", "lamp", "40"))
+
+    def test_reserve_does_not_overbook(self):
+        rules = lamp_rules()
+        self.assertTrue(rules.reserve("RQ1", "lamp"))
+        self.assertTrue(rules.reserve("RQ1", "lamp"))  # Repeated RESERVE for the same rq
+        self.assertFalse(rules.reserve("RQ2", "lamp"))
+        rules.sold("RQ1")
+        rules.sold("RQ2")
+        self.assertEqual(rules.items["lamp"]["quantity"], 0)
+
+    def test_released_unit_is_offered_again(self):
+        rules = lamp_rules()
+        rules.reserve("RQ1", "Lamp")
+        rules.release("RQ1")
+        self.assertEqual(rules.offer_price("LAMP"), 45)
+
+
+if __name__ == "__main__":
+    unittest.main()
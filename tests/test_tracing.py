@@ -0,0 +1,99 @@
+import json
+import os
+import tempfile
+import unittest
+
+from tracing import NULL_SPAN, Tracer
+
+
+def read_events(path):
+    """Parse a trace file the way chrome://tracing does, closing the array that is still being appended to."""
+    with open(path, "r") as file:
+        text = file.read()
+    return json.loads(text.rstrip().rstrip(",") + "]")
+
+
+class TracerTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "trace.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def create(self, *args, **kwargs):
+        tracer = Tracer(*args, **kwargs)
+        if tracer.enabled:
+            self.addCleanup(tracer.file.close)
+        return tracer
+
+    def test_disabled_tracer_returns_null_span_and_writes_nothing(self):
+        for tracer in (self.create(None), self.create(self.path, sample_rate=0)):
+            self.assertIs(tracer.span("RQ1", "handle"), NULL_SPAN)
+            self.assertIs(tracer.message_span("send", "FOUND RQ1 lamp 40", ("10.0.0.1", 6000)), NULL_SPAN)
+            tracer.complete("RQ1", "offer_window", 1.0, 2.0)
+            traced = tracer.traced("process")(lambda rq, value: f"{rq}={value}")
+            self.assertEqual(traced("RQ1", 5), "RQ1=5")
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_sampling_is_decided_per_rq(self):
+        tracer = self.create(self.path, sample_rate=0.5)
+        handle = tracer.traced("process")(lambda rq: None)
+        rqs = [f"RQ{n}" for n in range(200)]
+        for rq in rqs:
+            with tracer.span(rq, "handle"):
+                handle(rq)
+            with tracer.message_span("send", f"FOUND {rq} lamp 40", ("10.0.0.1", 6000)):
+                pass
+            tracer.complete(rq, "offer_window", 1.0, 2.0)
+
+        names = {}
+        for event in read_events(self.path):
+            if event["ph"] == "M" and event["name"] == "thread_name":
+                names[event["tid"]] = event["args"]["name"][len("rq "):]
+        spans = {}
+        for event in read_events(self.path):
+            if event["ph"] == "X":
+                spans.setdefault(names[event["tid"]], []).append(event["name"])
+
+        traced = {rq for rq in rqs if tracer.sampled(rq)}
+        self.assertTrue(0 < len(traced) < len(rqs))
+        self.assertEqual(set(spans), traced)
+        for rq in traced:  # Every stage of a sampled rq, none of the others
+            self.assertCountEqual(spans[rq], ["handle", "process", "send FOUND", "offer_window"])
+
+    def test_events_are_chrome_trace_json(self):
+        tracer = self.create(self.path, process_name="test server")
+        with tracer.span("RQ1", "handle LOOKING_FOR", source="10.0.0.1:6000"):
+            pass
+        with self.assertRaises(ValueError):
+            with tracer.span("RQ1", "process_offers"):
+                raise ValueError("bad price")
+        tracer.complete("RQ1", "offer_window", 1.5, 2.25)
+
+        events = read_events(self.path)
+        self.assertEqual(events[0], {"name": "process_name", "ph": "M", "pid": tracer.pid, "tid": 0,
+                                     "args": {"name": "test server"}})
+        self.assertEqual([event["args"] for event in events if event["name"] == "thread_name"], [{"name": "rq RQ1"}])
+        spans = [event for event in events if event["ph"] == "X"]
+        self.assertEqual([span["name"] for span in spans], ["handle LOOKING_FOR", "process_offers", "offer_window"])
+        for span in spans:
+            self.assertEqual(set(span), {"name", "ph", "ts", "dur", "pid", "tid", "args"})
+            self.assertIsInstance(span["ts"], int)
+            self.assertGreaterEqual(span["dur"], 0)
+        self.assertEqual(spans[0]["args"], {"source": "10.0.0.1:6000"})
+        self.assertEqual(spans[1]["args"], {"error": "ValueError('bad price')"})
+        self.assertEqual((spans[2]["ts"], spans[2]["dur"]), (1500000, 750000))
+
+    def test_spans_use_the_given_clock(self):
+        now = [100.0]
+        tracer = self.create(self.path, clock=lambda: now[0])
+        with tracer.span("RQ1", "broadcast_search"):
+            now[0] = 100.25
+        tracer.complete("RQ1", "offer_window", 100.0, 220.0)
+        spans = [event for event in read_events(self.path) if event["ph"] == "X"]
+        self.assertEqual([(span["ts"], span["dur"]) for span in spans], [(100000000, 250000), (100000000, 120000000)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import json
+import os
+import threading
+import time
+import zlib
+
+
+class NullSpan:
+    """Span returned when tracing is disabled or the request isn't sampled. Does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    def __init__(self, tracer, rq, name, args):
+        self.tracer = tracer
+        self.rq = rq
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = int(self.tracer.clock() * 1e6)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = int(self.tracer.clock() * 1e6)
+        if exc_type is not None:
+            self.args["error"] = repr(exc_value)
+        self.tracer.emit(self.rq, {
+            "name": self.name,
+            "ph": "X",
+            "ts": self.start,
+            "dur": end - self.start,
+            "args": self.args,
+        })
+        return False
+
+
+class Tracer:
+    """Record spans keyed by request number (rq) in the Chrome trace event format.
+
+    The output file is a JSON array that is appended to as spans finish, so it can be opened
+    at any time in chrome://tracing or https://ui.perfetto.dev. Each rq gets its own track.
+    Sampling is decided per rq, so a request is either traced in full or not at all.
+    `clock` returns the time in seconds, pass the server's clock so spans and `complete` use the same time.
+    """
+
+    def __init__(self, path=None, sample_rate=1.0, process_name="P2P Shopping Server", clock=time.time):
+        self.enabled = bool(path) and sample_rate > 0
+        self.sample_rate = sample_rate
+        self.clock = clock
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.tracks = set()
+        if self.enabled:
+            self.file = open(path, "w", buffering=1)
+            self.file.write("[\n")
+            self.write({"name": "process_name", "ph": "M", "pid": self.pid, "tid": 0,
+                        "args": {"name": process_name}})
+
+    def sampled(self, rq):
+        return zlib.crc32(rq.encode()) < self.sample_rate * 2 ** 32
+
+    def span(self, rq, name, **args):
+        """Context manager timing one stage of request `rq`."""
+        if not self.enabled or not self.sampled(rq):
+            return NULL_SPAN
+        return Span(self, rq, name, args)
+
+    def complete(self, rq, name, start, end, **args):
+        """Record a stage that started and ended in different places. `start` and `end` are in seconds."""
+        if not self.enabled or not self.sampled(rq):
+            return
+        self.emit(rq, {"name": name, "ph": "X", "ts": int(start * 1e6), "dur": int((end - start) * 1e6), "args": args})
+
+    def message_span(self, prefix, message, address):
+        """Span for sending a protocol message (`<COMMAND> <rq> ...`) to `address`."""
+        if not self.enabled:
+            return NULL_SPAN
+        parts = message.split(" ", 2)
+        if len(parts) < 2:
+            return NULL_SPAN
+        return self.span(parts[1], f"{prefix} {parts[0]}", to=f"{address[0]}:{address[1]}")
+
+    def traced(self, name):
+        """Decorator tracing a function whose first argument is the rq."""
+
+        def decorator(function):
+            def wrapper(rq, *args, **kwargs):
+                if not self.enabled:
+                    return function(rq, *args, **kwargs)
+                with self.span(rq, name):
+                    return function(rq, *args, **kwargs)
+
+            wrapper.__name__ = function.__name__
+            wrapper.__doc__ = function.__doc__
+            return wrapper
+
+        return decorator
+
+    def emit(self, rq, event):
+        tid = zlib.crc32(rq.encode())
+        event["pid"] = self.pid
+        event["tid"] = tid
+        with self.lock:
+            if tid not in self.tracks:
+                self.tracks.add(tid)
+                self.write({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid,
+                            "args": {"name": f"rq {rq}"}})
+            self.write(event)
+
+    def write(self, event):
+        self.file.write(json.dumps(event) + ",\n")
@@ -0,0 +1,42 @@
+import socket
+import threading
+import time
+
+
+class SocketTransport:
+    """Send the server's messages over real sockets. `udp_socket` is set once the UDP listener is bound."""
+
+    def __init__(self, buffer_size=1024):
+        self.buffer_size = buffer_size
+        self.udp_socket = None
+
+    def send_udp(self, message, address):
+        self.udp_socket.sendto(message.encode(), address)
+
+    def request_tcp(self, address, message, timeout):
+        """Send a message over a new TCP connection and return the response."""
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as tcp_socket:
+            tcp_socket.settimeout(timeout)
+            tcp_socket.connect(address)
+            tcp_socket.sendall(message.encode())
+            return tcp_socket.recv(self.buffer_size).decode()
+
+    def send_tcp(self, address, message, timeout):
+        """Send a message over a new TCP connection without waiting for a response."""
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as tcp_socket:
+            tcp_socket.settimeout(timeout)
+            tcp_socket.connect(address)
+            tcp_socket.sendall(message.encode())
+
+
+class RealClock:
+    """Wall-clock time, with timers running on their own threads."""
+
+    def time(self):
+        return time.time()
+
+    def call_later(self, delay, callback, *args):
+        timer = threading.Timer(delay, callback, args)
+        timer.daemon = True
+        timer.start()
+        return timer